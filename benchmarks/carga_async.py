@@ -0,0 +1,143 @@
+"""Benchmark de carga: rotas sync (threadpool) x rotas async (ASYNC_DB=1).
+
+Sobe o `main:app` com uvicorn duas vezes, uma por modo, cada uma com seu banco SQLite
+temporário, semeia alguns cadastros e dispara requisições concorrentes de pedidos
+(criar -> enviar -> obter). Mostra throughput e latências p50/p99 de cada modo.
+
+Uso:
+    pip install httpx aiosqlite
+    python benchmarks/carga_async.py --requisicoes 3000 --concorrencia 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+H = {"x-api-key": "dev-123"}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def subir_servidor(modo: str, porta: int, db_path: str, workers: int = 1, **env_extra) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", ASYNC_DB="1" if modo == "async" else "0", **env_extra)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(porta), "--log-level", "warning",
+         "--workers", str(workers)],
+        cwd=RAIZ, env=env,
+    )
+
+
+def parar_servidor(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+async def aguardar(base: str, timeout: float = 20.0):
+    fim = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base) as c:
+        while time.monotonic() < fim:
+            try:
+                if (await c.get("/status")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"servidor em {base} não respondeu")
+
+
+async def semear(c: httpx.AsyncClient, n_produtos: int) -> dict:
+    u = (await c.post("/unidades", json={"codigo": "U1", "nome": "Loja 1"}, headers=H)).json()
+    f = (await c.post("/fornecedores", json={"codigo": "F1", "razao_social": "Fornecedor 1"}, headers=H)).json()
+    produtos = []
+    for i in range(n_produtos):
+        p = (await c.post("/produtos", json={"codigo": f"P{i}", "nome": f"Produto {i}",
+                                             "fornecedor_id": f["id"], "preco": 1.5}, headers=H)).json()
+        produtos.append(p["id"])
+    return {"unidade_id": u["id"], "fornecedor_id": f["id"], "produtos": produtos}
+
+
+async def ciclo(c: httpx.AsyncClient, base: dict, latencias: list, erros: list):
+    payload = {"unidade_id": base["unidade_id"], "fornecedor_id": base["fornecedor_id"], "gerente_nome": "bench",
+               "itens": [{"produto_id": pid, "quantidade": 2} for pid in base["produtos"][:5]]}
+    for metodo, caminho, corpo in (("POST", "/pedidos", payload), ("POST", "/pedidos/{id}/enviar", None),
+                                   ("GET", "/pedidos/{id}", None)):
+        t0 = time.perf_counter()
+        r = await c.request(metodo, caminho.format(id=base.get("_id")), json=corpo, headers=H)
+        latencias.append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            erros.append(r.status_code)
+            return
+        if caminho == "/pedidos":
+            base = dict(base, _id=r.json()["id"])
+
+
+async def rodar_modo(modo: str, porta: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = subir_servidor(modo, porta, os.path.join(tmp, "bench.db"))
+        try:
+            url = f"http://127.0.0.1:{porta}"
+            await aguardar(url)
+            limites = httpx.Limits(max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia)
+            async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as c:
+                base = await semear(c, args.produtos)
+                latencias, erros = [], []
+                sem = asyncio.Semaphore(args.concorrencia)
+
+                async def um():
+                    async with sem:
+                        await ciclo(c, base, latencias, erros)
+
+                ciclos = max(1, args.requisicoes // 3)
+                t0 = time.perf_counter()
+                await asyncio.gather(*(um() for _ in range(ciclos)))
+                dur = time.perf_counter() - t0
+        finally:
+            parar_servidor(proc)
+    return {
+        "modo": modo,
+        "requisicoes": len(latencias),
+        "erros": len(erros),
+        "duracao_s": round(dur, 3),
+        "throughput_rps": round(len(latencias) / dur, 1),
+        "p50_ms": round(statistics.median(latencias) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+    }
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requisicoes", type=int, default=3000)
+    ap.add_argument("--concorrencia", type=int, default=200)
+    ap.add_argument("--produtos", type=int, default=20)
+    ap.add_argument("--porta", type=int, default=8765)
+    ap.add_argument("--json", help="grava o resultado neste arquivo")
+    args = ap.parse_args()
+
+    resultados = []
+    for i, modo in enumerate(("sync", "async")):
+        r = await rodar_modo(modo, args.porta + i, args)
+        resultados.append(r)
+        print(f"{modo:>5}: {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  "
+              f"p99 {r['p99_ms']:>8} ms  erros {r['erros']}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(resultados, fh, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
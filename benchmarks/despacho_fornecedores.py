@@ -0,0 +1,223 @@
+"""Teste do despacho de pedidos autorizados para fornecedores (outbox) contra um servidor local.
+
+Sobe um SMTP ou HTTP de mentira (que recusa de vez os fornecedores "recusa*" e falha
+temporariamente uma fração das entregas), sobe o `main:app` com ENVIO_MODO apontando para ele e
+autoriza pedidos em paralelo. Espera a fila esvaziar e confere: todo pedido autorizado chegou ao
+fornecedor ou está em "falhou" (dead letter) por recusa permanente, nada se perdeu, quantas
+mensagens foram precisas (lotes por fornecedor) e quantas tentativas extras. Sai com código 1 se
+algum pedido se perdeu.
+
+Uso:
+    pip install httpx
+    python benchmarks/despacho_fornecedores.py --modo smtp --pedidos 300 --falhas 0.3 --workers 2
+    python benchmarks/despacho_fornecedores.py --modo http --pedidos 300 --falhas 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from carga_async import RAIZ, H, aguardar, parar_servidor, subir_servidor
+
+
+class Caixa:
+    """O que o servidor de mentira recebeu: mensagens aceitas e pedidos entregues."""
+
+    def __init__(self, falhas: float):
+        self.falhas = falhas
+        self.mensagens = 0
+        self.pedidos: Counter = Counter()
+        self.recusas = 0
+        self.falhas_temporarias = 0
+        self._lock = threading.Lock()
+        self._rnd = random.Random(7)
+
+    def falhar(self) -> bool:
+        with self._lock:
+            if self._rnd.random() < self.falhas:
+                self.falhas_temporarias += 1
+                return True
+            return False
+
+    def entregar(self, ids):
+        with self._lock:
+            self.mensagens += 1
+            self.pedidos.update(ids)
+
+
+def subir_http(caixa: Caixa) -> tuple[str, callable]:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            msg = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if msg["fornecedor"]["codigo"].startswith("recusa"):
+                caixa.recusas += 1
+                codigo = 422
+            elif caixa.falhar():
+                codigo = 503
+            else:
+                caixa.entregar(p["id"] for p in msg["pedidos"])
+                codigo = 200
+            self.send_response(codigo)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *_):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{srv.server_address[1]}/pedidos", srv.shutdown
+
+
+def subir_smtp(caixa: Caixa) -> tuple[int, callable]:
+    # o mínimo de SMTP que o smtplib usa: EHLO, MAIL, RCPT, DATA, QUIT
+    async def sessao(reader, writer):
+        writer.write(b"220 stand-in\r\n")
+        dados = None
+        while linha := await reader.readline():
+            if dados is not None:
+                if linha.rstrip(b"\r\n") == b".":
+                    ids = message_from_bytes(b"".join(dados))["X-Pedidos"]
+                    caixa.entregar(int(i) for i in ids.split(","))
+                    writer.write(b"250 OK\r\n")
+                    dados = None
+                else:
+                    dados.append(linha[1:] if linha.startswith(b"..") else linha)
+                continue
+            cmd = linha.decode().strip().upper()
+            if cmd.startswith(("EHLO", "HELO")):
+                writer.write(b"250 stand-in\r\n")
+            elif cmd.startswith("MAIL") and caixa.falhar():
+                writer.write(b"451 tente mais tarde\r\n")
+            elif cmd.startswith("RCPT") and "RECUSA" in cmd:
+                caixa.recusas += 1
+                writer.write(b"550 caixa inexistente\r\n")
+            elif cmd == "DATA":
+                writer.write(b"354 termine com .\r\n")
+                dados = []
+            elif cmd == "QUIT":
+                writer.write(b"221 tchau\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
+
+    loop = asyncio.new_event_loop()
+    srv = loop.run_until_complete(asyncio.start_server(sessao, "127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return srv.sockets[0].getsockname()[1], lambda: loop.call_soon_threadsafe(loop.stop)
+
+
+async def rodar(args, porta_app: int, env: dict, caixa: Caixa) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "despacho.db")
+        env = dict(env, SQLITE_PERFIL="producao")
+        subprocess.run([sys.executable, "-c", "import main; main.preparar_banco()"], cwd=RAIZ, check=True,
+                       env=dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", **env))
+        proc = subir_servidor("sync", porta_app, db_path, workers=args.workers, **env)
+        try:
+            url = f"http://127.0.0.1:{porta_app}"
+            await aguardar(url)
+            async with httpx.AsyncClient(base_url=url, headers=H, timeout=60) as c:
+                u = (await c.post("/unidades", json={"codigo": "U1", "nome": "Loja 1"})).json()
+                produtos, recusados = [], set()
+                for i in range(args.fornecedores):
+                    codigo = f"recusa{i}" if i < args.recusados else f"F{i}"
+                    f = (await c.post("/fornecedores", json={"codigo": codigo, "razao_social": f"Fornecedor {i}",
+                                                              "email_pedidos": f"{codigo}@fornecedor.test"})).json()
+                    p = (await c.post("/produtos", json={"codigo": f"P{i}", "nome": f"Produto {i}",
+                                                         "fornecedor_id": f["id"], "preco": 9.9})).json()
+                    produtos.append(p)
+                    if i < args.recusados:
+                        recusados.add(f["id"])
+                lote = [{"unidade_id": u["id"], "fornecedor_id": produtos[i % len(produtos)]["fornecedor_id"],
+                         "gerente_nome": "despacho",
+                         "itens": [{"produto_id": produtos[i % len(produtos)]["id"], "quantidade": 2}]}
+                        for i in range(args.pedidos)]
+                criados = (await c.post("/pedidos/bulk", json={"pedidos": lote})).json()
+                ids = [r["pedido_id"] for r in criados]
+                fornecedor_de = {pid: lote[i]["fornecedor_id"] for i, pid in enumerate(ids)}
+
+                t0 = time.perf_counter()
+                sem = asyncio.Semaphore(args.concorrencia)
+
+                async def autorizar(pid):
+                    async with sem:
+                        r = await c.post(f"/pedidos/{pid}/enviar")
+                        assert r.status_code == 200 and r.json()["status"] == "autorizado", r.text
+
+                await asyncio.gather(*(autorizar(pid) for pid in ids))
+                while (await c.get("/envios", params={"status": "pendente", "limit": 1})).json():
+                    if time.perf_counter() - t0 > args.timeout:
+                        print(f"ERRO: a fila não esvaziou em {args.timeout}s")
+                        return 1
+                    await asyncio.sleep(0.1)
+                dur = time.perf_counter() - t0
+                envios = (await c.get("/envios", params={"limit": 1000})).json()
+        finally:
+            parar_servidor(proc)
+
+    falhou = {e["pedido_id"] for e in envios if e["status"] == "falhou"}
+    esperado_falhou = {pid for pid in ids if fornecedor_de[pid] in recusados}
+    entregues = set(caixa.pedidos)
+    perdidos = set(ids) - entregues - falhou
+    repetidos = sum(n - 1 for n in caixa.pedidos.values())
+    extras = sum(e["tentativas"] for e in envios if e["status"] == "enviado") - len(entregues & set(ids))
+    print(f"modo {args.modo}: {len(ids)} pedidos autorizados, fila vazia em {dur:.2f}s")
+    print(f"  entregues {len(entregues)} em {caixa.mensagens} mensagens "
+          f"({len(entregues) / max(caixa.mensagens, 1):.1f} pedidos/mensagem), repetidos {repetidos}")
+    print(f"  falhas temporárias {caixa.falhas_temporarias} (tentativas extras {extras}), "
+          f"recusas permanentes {caixa.recusas}, dead letter {len(falhou)}")
+    if perdidos or falhou != esperado_falhou:
+        print(f"ERRO: perdidos {sorted(perdidos)[:20]}, dead letter inesperada {sorted(falhou ^ esperado_falhou)[:20]}")
+        return 1
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modo", choices=["smtp", "http"], default="smtp")
+    ap.add_argument("--pedidos", type=int, default=300, help="até 1000 (um GET /envios confere tudo)")
+    ap.add_argument("--fornecedores", type=int, default=10)
+    ap.add_argument("--recusados", type=int, default=1, help="fornecedores que recusam de vez (dead letter)")
+    ap.add_argument("--falhas", type=float, default=0.3, help="fração das entregas com falha temporária")
+    ap.add_argument("--workers", type=int, default=2, help="processos uvicorn (disputam a mesma fila)")
+    ap.add_argument("--despachantes", type=int, default=2, help="ENVIO_WORKERS por processo")
+    ap.add_argument("--concorrencia", type=int, default=16)
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--porta", type=int, default=8795)
+    args = ap.parse_args()
+    if args.pedidos > 1000:
+        ap.error("--pedidos acima de 1000")
+
+    caixa = Caixa(args.falhas)
+    env = {"ENVIO_MODO": args.modo, "ENVIO_WORKERS": str(args.despachantes), "ENVIO_INTERVALO": "0.5",
+           "ENVIO_BACKOFF_BASE": "0.05", "ENVIO_BACKOFF_MAX": "1", "ENVIO_TIMEOUT": "5", "ENVIO_MAX_TENTATIVAS": "12"}
+    if args.modo == "http":
+        url, parar = subir_http(caixa)
+        env["ENVIO_HTTP_URL"] = url
+    else:
+        porta, parar = subir_smtp(caixa)
+        env.update(SMTP_HOST="127.0.0.1", SMTP_PORT=str(porta))
+    try:
+        codigo = asyncio.run(rodar(args, args.porta, env, caixa))
+    finally:
+        parar()
+    sys.exit(codigo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Teste de estresse de concorrência no SQLite: perfil "padrao" x "producao".
+
+Para cada perfil sobe o `main:app` (opcionalmente com vários workers disputando o mesmo
+arquivo) e roda, em paralelo, o fluxo completo de escrita (criar -> enviar -> aprovar ->
+receber) junto com leitores fazendo `GET /pedidos`. Conta respostas de erro e quantas delas
+foram "database is locked". Sai com código 1 se o perfil de produção tiver algum erro.
+
+Uso:
+    pip install httpx
+    python benchmarks/estresse_sqlite.py --fluxos 400 --concorrencia 64 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from carga_async import RAIZ, H, aguardar, parar_servidor, percentil, subir_servidor
+
+
+async def semear(c: httpx.AsyncClient) -> dict:
+    u = (await c.post("/unidades", json={"codigo": "U1", "nome": "Loja 1"}, headers=H)).json()
+    f = (await c.post("/fornecedores", json={"codigo": "F1", "razao_social": "Fornecedor 1"}, headers=H)).json()
+    p1 = (await c.post("/produtos", json={"codigo": "P1", "nome": "Café", "fornecedor_id": f["id"], "preco": 30},
+                       headers=H)).json()
+    p2 = (await c.post("/produtos", json={"codigo": "P2", "nome": "Leite", "fornecedor_id": f["id"], "preco": 5},
+                       headers=H)).json()
+    # P2 com limite baixo força metade dos pedidos a passar por aprovação
+    await c.post("/limites", json={"unidade_id": u["id"], "produto_id": p2["id"], "minimo": 0, "maximo": 5},
+                 headers=H)
+    return {"unidade_id": u["id"], "fornecedor_id": f["id"], "p1": p1["id"], "p2": p2["id"]}
+
+
+async def fluxo(c: httpx.AsyncClient, base: dict, i: int, stats: dict):
+    async def chamar(metodo, caminho, corpo=None):
+        t0 = time.perf_counter()
+        try:
+            r = await c.request(metodo, caminho, json=corpo, headers=H)
+        except httpx.HTTPError:
+            stats["erros"] += 1
+            return None
+        stats["lat"].append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            stats["erros"] += 1
+            if "locked" in r.text:
+                stats["locked"] += 1
+            return None
+        return r.json()
+
+    qtd = 10 if i % 2 else 2
+    p = await chamar("POST", "/pedidos", {"unidade_id": base["unidade_id"], "fornecedor_id": base["fornecedor_id"],
+                                          "gerente_nome": "estresse",
+                                          "itens": [{"produto_id": base["p1"], "quantidade": 1},
+                                                    {"produto_id": base["p2"], "quantidade": qtd}]})
+    if not p:
+        return
+    p = await chamar("POST", f"/pedidos/{p['id']}/enviar")
+    if p and p["status"] == "pendente_aprovacao":
+        p = await chamar("POST", f"/pedidos/{p['id']}/aprovar", {"decisor": "Matriz", "aprovado": True})
+    if p:
+        await chamar("POST", f"/pedidos/{p['id']}/recebimentos",
+                     {"data_recebimento": "2026-01-01", "quantidade_recebida": 1})
+    await chamar("GET", "/pedidos?limit=50")
+
+
+async def rodar_perfil(perfil: str, porta: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "estresse.db")
+        # migra o banco antes, para os workers não disputarem o preparar_banco do startup
+        subprocess.run([sys.executable, "-c", "import main; main.preparar_banco()"], cwd=RAIZ, check=True,
+                       env=dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", SQLITE_PERFIL=perfil))
+        proc = subir_servidor("sync", porta, db_path, workers=args.workers, SQLITE_PERFIL=perfil)
+        try:
+            url = f"http://127.0.0.1:{porta}"
+            await aguardar(url)
+            limites = httpx.Limits(max_connections=args.concorrencia)
+            async with httpx.AsyncClient(base_url=url, limits=limites, timeout=120) as c:
+                base = await semear(c)
+                stats = {"erros": 0, "locked": 0, "lat": []}
+                sem = asyncio.Semaphore(args.concorrencia)
+
+                async def um(i):
+                    async with sem:
+                        await fluxo(c, base, i, stats)
+
+                t0 = time.perf_counter()
+                await asyncio.gather(*(um(i) for i in range(args.fluxos)))
+                dur = time.perf_counter() - t0
+        finally:
+            parar_servidor(proc)
+    return {"perfil": perfil, "requisicoes": len(stats["lat"]) + stats["erros"], "erros": stats["erros"],
+            "locked": stats["locked"], "rps": round(len(stats["lat"]) / dur, 1),
+            "p99_ms": round(percentil(stats["lat"], 99) * 1000, 1) if stats["lat"] else None}
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--fluxos", type=int, default=400)
+    ap.add_argument("--concorrencia", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--porta", type=int, default=8775)
+    args = ap.parse_args()
+
+    resultados = []
+    for i, perfil in enumerate(("padrao", "producao")):
+        r = await rodar_perfil(perfil, args.porta + i, args)
+        resultados.append(r)
+        print(f"{perfil:>8}: {r['requisicoes']} req  erros {r['erros']} (locked {r['locked']})  "
+              f"{r['rps']} req/s  p99 {r['p99_ms']} ms")
+    sys.exit(1 if resultados[-1]["erros"] else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Benchmark da serialização de GET /pedidos: caminho rápido (Core -> JSON) x ORM + PedidoOut.
+
+Semeia um banco sintético (mesma semeadura do ciclo_pedidos.py), lista páginas de pedidos pelo
+caminho antigo (objetos ORM com selectinload, validação from_attributes do PedidoOut e o
+JSONResponse do FastAPI) e pelo caminho rápido da rota, confere que os bytes são idênticos e
+reporta CPU (process_time) por pedido.
+
+Uso:
+    python benchmarks/serializacao_pedidos.py --pedidos-base 20000 --pagina 1000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+H = {"x-api-key": "dev-123"}
+
+
+def caminho_orm(main, limite: int) -> bytes:
+    # o que a rota fazia antes: ORM + response_model (validate from_attributes, dump json, JSONResponse)
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from sqlalchemy.orm import selectinload
+
+    adapter = TypeAdapter(List[main.PedidoOut])
+    with main.SessionLocal() as db:
+        pedidos = (db.query(main.Pedido).options(selectinload(main.Pedido.itens))
+                   .order_by(main.Pedido.criado_em.desc(), main.Pedido.id.desc()).limit(limite).all())
+        conteudo = adapter.dump_python(adapter.validate_python(pedidos, from_attributes=True), mode="json")
+    return JSONResponse(conteudo).body
+
+
+def caminho_rapido(main, limite: int) -> bytes:
+    from sqlalchemy import select
+
+    with main.SessionLocal() as db:
+        stmt = (select(*main._COLUNAS_PEDIDO)
+                .order_by(main.Pedido.criado_em.desc(), main.Pedido.id.desc()).limit(limite))
+        return main.pedidos_json(db, db.execute(stmt).all())
+
+
+def medir(fn, repeticoes: int) -> float:
+    fn()  # aquece caches de statement/compilação
+    t0 = time.process_time()
+    for _ in range(repeticoes):
+        fn()
+    return (time.process_time() - t0) / repeticoes
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="arquivo SQLite (reaproveitado entre execuções); padrão: temporário")
+    ap.add_argument("--unidades", type=int, default=20)
+    ap.add_argument("--fornecedores", type=int, default=10)
+    ap.add_argument("--produtos", type=int, default=1000)
+    ap.add_argument("--limites-por-unidade", type=int, default=50)
+    ap.add_argument("--pedidos-base", type=int, default=20_000)
+    ap.add_argument("--pagina", type=int, default=1000, help="pedidos por listagem")
+    ap.add_argument("--repeticoes", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    tmp = None
+    if not args.db:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmp.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    sys.path.insert(0, RAIZ)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main  # noqa: E402 (depende do DATABASE_URL acima)
+    from ciclo_pedidos import semear  # noqa: E402
+    from fastapi.testclient import TestClient  # noqa: E402
+
+    main.preparar_banco()
+    semear(main, args, random.Random(args.seed))
+
+    antigo = caminho_orm(main, args.pagina)
+    rota = TestClient(main.app).get("/pedidos", params={"limit": args.pagina}, headers=H).content
+    if not (antigo == caminho_rapido(main, args.pagina) == rota):
+        raise SystemExit("ERRO: o caminho rápido não gerou os mesmos bytes do response_model")
+    print(f"bytes idênticos ({len(antigo)} bytes, {args.pagina} pedidos)")
+
+    resultados = {"orm + PedidoOut": medir(lambda: caminho_orm(main, args.pagina), args.repeticoes)}
+    if main.orjson is not None:
+        resultados["rápido (orjson)"] = medir(lambda: caminho_rapido(main, args.pagina), args.repeticoes)
+    encoder, main.orjson = main.orjson, None
+    resultados["rápido (json stdlib)"] = medir(lambda: caminho_rapido(main, args.pagina), args.repeticoes)
+    main.orjson = encoder
+
+    base = resultados["orm + PedidoOut"]
+    print(f"\n{'caminho':<22} {'ms/página':>10} {'µs/pedido':>10} {'ganho':>7}")
+    for nome, seg in resultados.items():
+        print(f"{nome:<22} {seg * 1000:>10.1f} {seg / args.pagina * 1e6:>10.1f} {base / seg:>6.1f}x")
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main_cli()
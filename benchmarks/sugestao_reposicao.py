@@ -0,0 +1,157 @@
+"""Benchmark da sugestão de reposição (GET /unidades/{id}/sugestao e POST /sugestao/rascunhos).
+
+Semeia um banco sintético (mesma semeadura do ciclo_pedidos.py), confere a sugestão vetorizada
+contra um cálculo em Python puro direto das tabelas de pedidos e mede: montagem das estatísticas,
+sugestão de uma unidade pela rota, sugestão de todas as unidades de uma vez, atualização
+incremental depois de um commit e a geração dos rascunhos em lote.
+
+Uso:
+    python benchmarks/sugestao_reposicao.py --unidades 300 --produtos 5000 --pedidos-base 200000
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+H = {"x-api-key": "dev-123"}
+
+
+def referencia(main, db, unidade_id: int) -> dict[int, float]:
+    """Mesma regra da sugerir(), laço a laço sobre pedidos e itens (sem resumo nem NumPy)."""
+    from datetime import date
+
+    from sqlalchemy import select
+
+    s = main.settings
+    hoje = date.today()
+    atual = main.mes_indice(hoje.year, hoje.month)
+    inicio = atual - s.SUGESTAO_MESES
+    dias = (hoje - date(inicio // 12, inicio % 12 + 1, 1)).days + 1
+    recebido, aberto = defaultdict(lambda: [0.0] * (s.SUGESTAO_MESES + 1)), defaultdict(float)
+    P, I = main.Pedido, main.ItemPedido
+    for criado, status, prod, qtd in db.execute(select(P.criado_em, P.status, I.produto_id, I.quantidade)
+                                                .join(I, I.pedido_id == P.id).where(P.unidade_id == unidade_id)):
+        col = main.mes_indice(criado.year, criado.month) - inicio
+        if status == main.OrderStatus.RECEBIDO and col >= 0:
+            recebido[prod][col] += qtd
+        elif status in main.STATUS_EM_ABERTO:
+            aberto[prod] += qtd
+    produtos = {p.id: p for p in db.scalars(select(main.Produto))}
+    sla = dict(db.execute(select(main.Fornecedor.id, main.Fornecedor.sla_dias)).all())
+    limites = {l.produto_id: l for l in db.scalars(select(main.Limite).where(main.Limite.unidade_id == unidade_id))}
+    esperado = {}
+    for prod in set(recebido) | set(aberto):
+        meses = recebido[prod]
+        taxa = sum(meses) / dias
+        cobertura = sla[produtos[prod].fornecedor_id] + s.SUGESTAO_CICLO_DIAS
+        seguranca = s.SUGESTAO_Z * statistics.pstdev(meses[:-1]) * math.sqrt(cobertura / 30)
+        nec = taxa * cobertura + seguranca - aberto[prod]
+        qtd = math.ceil(nec)
+        if prod in limites:
+            qtd = min(max(qtd, limites[prod].minimo), limites[prod].maximo)
+        if nec > 0 and produtos[prod].ativo and qtd > 0:
+            esperado[prod] = float(qtd)
+    return esperado
+
+
+def cronometrar(fn, repeticoes: int = 1) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeticoes):
+        r = fn()
+    cronometrar.ultimo = r
+    return (time.perf_counter() - t0) / repeticoes
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="arquivo SQLite (reaproveitado entre execuções); padrão: temporário")
+    ap.add_argument("--database-url", help="outro banco (ex.: postgresql+psycopg://...); precisa estar vazio")
+    ap.add_argument("--unidades", type=int, default=300)
+    ap.add_argument("--fornecedores", type=int, default=50)
+    ap.add_argument("--produtos", type=int, default=5000)
+    ap.add_argument("--limites-por-unidade", type=int, default=200)
+    ap.add_argument("--pedidos-base", type=int, default=200_000)
+    ap.add_argument("--conferir", type=int, default=5, help="unidades conferidas contra o cálculo de referência")
+    ap.add_argument("--repeticoes", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    tmp = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        if not args.db:
+            tmp = tempfile.TemporaryDirectory()
+            args.db = os.path.join(tmp.name, "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    sys.path.insert(0, RAIZ)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main  # noqa: E402 (depende do DATABASE_URL acima)
+    from ciclo_pedidos import semear  # noqa: E402
+    from fastapi.testclient import TestClient  # noqa: E402
+
+    main.preparar_banco()
+    rnd = random.Random(args.seed)
+    cat = semear(main, args, rnd)
+    cliente = TestClient(main.app)
+
+    with main.SessionLocal() as db:
+        t_montar = cronometrar(lambda: (main.consumo.invalidar(), main.consumo.obter(db))[1])
+        est = cronometrar.ultimo
+        pares = len(est["chaves"])
+        amostra = rnd.sample(cat["unidades"], min(args.conferir, len(cat["unidades"])))
+        for u in amostra:
+            obtido = {s["produto_id"]: s["quantidade"]
+                      for s in cliente.get(f"/unidades/{u}/sugestao", headers=H).json()}
+            esperado = referencia(main, db, u)
+            if obtido != esperado:
+                difere = sorted(set(obtido.items()) ^ set(esperado.items()))[:10]
+                raise SystemExit(f"ERRO: unidade {u} difere do cálculo de referência: {difere}")
+        print(f"sugestão confere com a referência em {len(amostra)} unidades")
+
+        t_rota = cronometrar(lambda: cliente.get(f"/unidades/{rnd.choice(cat['unidades'])}/sugestao", headers=H),
+                             args.repeticoes)
+        t_todas = cronometrar(lambda: main.sugerir(main.consumo.obter(db)), args.repeticoes)
+        sugeridos = len(cronometrar.ultimo["produto_id"])
+
+    # um pedido novo pela API num par já conhecido: o commit só soma o delta nos arrays montados
+    u, prod = int(est["unidade"][0]), int(est["produto"][0])
+    aberto_antes = float(est["aberto"][0])
+    forn = int(est["fornecedor"][prod])
+    r = cliente.post("/pedidos", headers=H, json={"unidade_id": u, "fornecedor_id": forn, "gerente_nome": "bench",
+                                                  "itens": [{"produto_id": prod, "quantidade": 1}]})
+    assert r.status_code in (200, 201), r.text
+    with main.SessionLocal() as db:
+        t_delta = cronometrar(lambda: main.consumo.obter(db))
+        novo = cronometrar.ultimo
+        if novo["montado"] != est["montado"]:
+            raise SystemExit("ERRO: o commit remontou as estatísticas em vez de aplicar o delta")
+        if novo["aberto"][0] != aberto_antes + 1 or est["aberto"][0] != aberto_antes:
+            raise SystemExit("ERRO: o delta não foi aplicado numa cópia (copy-on-write) dos arrays")
+
+    t_rascunhos = cronometrar(lambda: cliente.post("/sugestao/rascunhos", headers=H, json={}))
+    criados = cronometrar.ultimo.json()
+    erros = [c for c in criados if not c["ok"]]
+    if erros:
+        raise SystemExit(f"ERRO: {len(erros)} rascunhos recusados, ex.: {erros[0]}")
+    restante = len(main.sugerir(main.consumo.obter(main.SessionLocal())).get("produto_id", []))
+
+    print(f"\n{pares} pares (unidade, produto), {len(cat['unidades'])} unidades, {len(cat['todos_produtos'])} produtos")
+    print(f"  montagem das estatísticas       {t_montar * 1000:8.1f} ms")
+    print(f"  GET /unidades/{{id}}/sugestao     {t_rota * 1000:8.1f} ms")
+    print(f"  sugestão de todas as unidades   {t_todas * 1000:8.1f} ms  ({sugeridos} itens sugeridos)")
+    print(f"  obter() depois de um commit     {t_delta * 1000:8.1f} ms  (delta aplicado)")
+    print(f"  POST /sugestao/rascunhos        {t_rascunhos * 1000:8.1f} ms  ({len(criados)} rascunhos)")
+    print(f"  itens sugeridos depois dos rascunhos: {restante}")
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main_cli()
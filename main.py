@@ -1,51 +1,323 @@
+import time
+INICIO = time.perf_counter()  # antes dos demais imports: base de INICIALIZACAO
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # executável do PyInstaller: processos filhos param aqui, antes dos imports
+import base64
+import contextvars
+import csv
+import hashlib
+import io
+import json
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, date
 from enum import Enum
-from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, Header, status
+from typing import Callable, Iterator, List, Literal, Optional, get_args
+try:
+    import orjson
+except ImportError:  # opcional: sem ele a listagem usa o encoder C do json da stdlib
+    orjson = None
+try:
+    import fcntl
+except ImportError:  # Windows: a fila de escrita fica só entre threads do processo
+    fcntl = None
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Header, Query, Request, Response, status
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
 from pydantic.config import ConfigDict
 from pydantic_settings import BaseSettings
 from sqlalchemy import (
-    create_engine, String, Integer, Float, DateTime, Enum as SAEnum,
-    ForeignKey, Boolean, Date, func
+    create_engine, event, make_url, String, Integer, Float, DateTime, Enum as SAEnum,
+    ForeignKey, Boolean, Date, Index, LargeBinary, Numeric, bindparam, delete, extract, func, insert, literal, or_, select,
+    tuple_, update
 )
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker, Mapped, mapped_column, Session
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME, insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, selectinload, Mapped, mapped_column, Session
 
 
 
+# =========================
+# Métricas
+# =========================
+# Registro mínimo no formato texto do Prometheus (sem dependência extra), exposto em /metrics.
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SQL = (1, 2, 5, 10, 20, 50, 100, 250)
+
+class Metrica:
+    def __init__(self, nome: str, ajuda: str, tipo: str, buckets: tuple = ()):
+        self.nome, self.ajuda, self.tipo, self.buckets = nome, ajuda, tipo, buckets
+        self._valores: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float = 1.0, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            v = self._valores.get(chave)
+            if v is None:
+                v = self._valores[chave] = [0.0, 0] + [0] * len(self.buckets)  # soma, contagem, buckets
+            v[0] += valor
+            v[1] += 1
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    v[2 + i] += 1
+
+    def valores(self) -> dict[tuple, tuple[float, int]]:
+        # {labels: (soma, contagem)}; usado pelos benchmarks para medir SQL por rota
+        with self._lock:
+            return {k: (v[0], v[1]) for k, v in self._valores.items()}
+
+    def exportar(self) -> list[str]:
+        def fmt(labels, extra=()):
+            pares = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return "{" + ",".join(pares) + "}" if pares else ""
+
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            itens = [(k, list(v)) for k, v in self._valores.items()]
+        for labels, v in itens:
+            if self.tipo == "counter":
+                linhas.append(f"{self.nome}{fmt(labels)} {v[0]}")
+                continue
+            for limite, n in zip(self.buckets, v[2:]):
+                linhas.append(f"{self.nome}_bucket{fmt(labels, [('le', limite)])} {n}")
+            linhas.append(f"{self.nome}_bucket{fmt(labels, [('le', '+Inf')])} {v[1]}")
+            linhas.append(f"{self.nome}_sum{fmt(labels)} {v[0]}")
+            linhas.append(f"{self.nome}_count{fmt(labels)} {v[1]}")
+        return linhas
+
+HTTP_REQUISICOES = Metrica("mqc_http_requests_total", "Requisições HTTP por rota e status.", "counter")
+HTTP_LATENCIA = Metrica("mqc_http_request_duration_seconds", "Latência das requisições por rota.", "histogram", BUCKETS_LATENCIA)
+SQL_POR_REQUISICAO = Metrica("mqc_sql_statements_per_request", "Comandos SQL emitidos por requisição.", "histogram", BUCKETS_SQL)
+SQL_TEMPO = Metrica("mqc_sql_duration_seconds", "Tempo gasto em SQL por requisição.", "histogram", BUCKETS_LATENCIA)
+POOL_ESPERA = Metrica("mqc_db_pool_checkout_wait_seconds", "Espera por uma conexão livre no pool.", "histogram", BUCKETS_LATENCIA)
+SQL_ERROS = Metrica("mqc_sql_errors_total", "Comandos SQL que falharam, por tipo de erro.", "counter")
+METRICAS = [HTTP_REQUISICOES, HTTP_LATENCIA, SQL_POR_REQUISICAO, SQL_TEMPO, POOL_ESPERA, SQL_ERROS]
+
 # =========================
 # Config & DB
 # =========================
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./app.db"
-    API_KEYS: list[str] = ["dev-123"]  # troque/adicione aqui ou use variável de ambiente
+    HOST: str = "127.0.0.1"  # python main.py / executável (com uvicorn direto, use as opções dele)
+    PORT: int = 8000
+    WORKERS: int = Field(1, ge=0)  # processos servindo a mesma porta; 0 = um por núcleo
+    HEADLESS: bool = False  # não abre o navegador no painel ao iniciar (servidor, container)
+    MIGRAR_AO_INICIAR: bool = True  # aplica as migrations (alembic upgrade head) no startup; dados iniciais sempre
+    DB_POOL_SIZE: int = 10  # Postgres e outros servidores (o SQLite usa SQLITE_POOL_*)
+    DB_POOL_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0  # segundos esperando uma conexão livre antes de erro
+    DB_POOL_RECYCLE: int = 1800  # segundos; renova conexões antes de proxies/firewalls derrubarem (-1 desliga)
+    DB_POOL_PRE_PING: bool = True  # testa a conexão no checkout (reconecta após restart/failover do banco)
+    API_KEYS: list[str] = ["dev-123"]  # chaves admin garantidas a cada início; as demais via /api-keys
+    API_KEYS_CACHE_TTL: float = 30.0  # segundos até outro processo enxergar chave criada/revogada
+    RATE_LIMIT_RPS: Optional[float] = None  # limite padrão por chave (token bucket); None = sem limite
+    RATE_LIMIT_RAJADA: int = 50  # requisições acumuláveis no balde quando não definido na chave
+    IDEMPOTENCIA_TTL: float = 24 * 3600  # segundos que uma resposta fica disponível para replay
+    IDEMPOTENCIA_MAX: int = 100_000  # teto de respostas guardadas (as mais antigas saem primeiro)
+    IDEMPOTENCIA_ESPERA: float = 30.0  # quanto uma duplicata espera a original terminar antes do 409
+    CATALOGO_CACHE_MAX: int = 10_000  # entradas no cache de cadastros (LRU)
+    CATALOGO_CACHE_TTL: float = 60.0  # segundos; limita a defasagem entre processos
+    ASYNC_DB: bool = False  # rotas de pedidos/fluxo com AsyncSession (aiosqlite/asyncpg)
+    SQLITE_PERFIL: Literal["padrao", "producao"] = "padrao"
+    SQLITE_BUSY_TIMEOUT_MS: int = 10_000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_KB: int = 64 * 1024
+    SQLITE_POOL_SIZE: int = 20  # leitores simultâneos (WAL); escritas usam a fila abaixo
+    SQLITE_POOL_OVERFLOW: int = 20
+    SLOW_REQUEST_MS: Optional[float] = None  # se definido, loga requisições lentas com o SQL que emitiram
+    EVENTOS_BUFFER: int = 1000  # eventos recentes guardados para retomar via Last-Event-ID
+    EVENTOS_FILA: int = 500  # eventos pendentes por conexão antes de derrubar um cliente lento
+    ENVIO_MODO: Literal["desligado", "smtp", "http"] = "desligado"  # como pedidos autorizados chegam ao fornecedor
+    ENVIO_WORKERS: int = 2
+    ENVIO_LOTE: int = 50  # pedidos do mesmo fornecedor por mensagem
+    ENVIO_INTERVALO: float = 5.0  # segundos entre consultas à fila quando não há nada vencido
+    ENVIO_MAX_TENTATIVAS: int = 8  # esgotadas, o envio fica como "falhou" (dead letter)
+    ENVIO_BACKOFF_BASE: float = 30.0  # segundos; dobra a cada tentativa, até ENVIO_BACKOFF_MAX
+    ENVIO_BACKOFF_MAX: float = 3600.0
+    ENVIO_TIMEOUT: float = 30.0  # por tentativa (SMTP/HTTP)
+    ENVIO_HTTP_URL: Optional[str] = None  # ENVIO_MODO=http: recebe cada lote em JSON (POST)
+    SMTP_HOST: str = "localhost"
+    SMTP_PORT: int = 25
+    SMTP_TLS: bool = False  # STARTTLS
+    SMTP_USUARIO: Optional[str] = None
+    SMTP_SENHA: Optional[str] = None
+    SMTP_REMETENTE: str = "pedidos@maisquecafe.com.br"
+    SUGESTAO_MESES: int = Field(3, ge=1)  # meses fechados de histórico (além do mês corrente) no consumo médio
+    SUGESTAO_CICLO_DIAS: float = 7.0  # dias até o próximo pedido, somados ao sla_dias do fornecedor
+    SUGESTAO_Z: float = 1.65  # estoque de segurança em desvios-padrão (~95% de nível de serviço)
+    SUGESTAO_TTL: float = 300.0  # segundos até reconstruir as estatísticas (mudanças de outros processos)
 
 settings = Settings()
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if settings.DATABASE_URL.startswith("sqlite") else {}
-)
+log = logging.getLogger("mqc")
+log_servidor = logging.getLogger("uvicorn.error")  # mensagens de inicialização junto com as do uvicorn
+INICIALIZACAO: dict[str, float] = {}  # segundos desde INICIO por fase ("import", "pronto"); /status e /metrics
+
+SQLITE = settings.DATABASE_URL.startswith("sqlite")
+# perfil "producao": WAL + pragmas e escritas serializadas (não se aplica a banco em memória)
+SQLITE_MEMORIA = SQLITE and (":memory:" in settings.DATABASE_URL or settings.DATABASE_URL.rstrip("/") == "sqlite:")
+SQLITE_PRODUCAO = SQLITE and settings.SQLITE_PERFIL == "producao" and not SQLITE_MEMORIA
+
+def configurar_sqlite(engine):
+    # pysqlite abre transações sozinho (e tarde); desligamos isso e emitimos o BEGIN nós mesmos,
+    # IMMEDIATE para sessões de escrita: o lock de escrita é pego no início e respeita o busy_timeout,
+    # em vez de falhar com "database is locked" ao promover uma leitura em escrita.
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _):
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cur.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cur.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_KB)}")
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("escrita") else "BEGIN")
+
+class PoolMedido(QueuePool):
+    # QueuePool que mede quanto cada checkout esperou por uma conexão livre
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_ESPERA.observar(time.perf_counter() - t0)
+
+engine_kwargs = {}
+if not SQLITE_MEMORIA:
+    engine_kwargs["poolclass"] = PoolMedido
+if SQLITE:
+    engine_kwargs["connect_args"] = {"check_same_thread": False}
+if SQLITE_PRODUCAO:
+    engine_kwargs.update(pool_size=settings.SQLITE_POOL_SIZE, max_overflow=settings.SQLITE_POOL_OVERFLOW)
+if not SQLITE:
+    engine_kwargs.update(pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_POOL_OVERFLOW,
+                         pool_timeout=settings.DB_POOL_TIMEOUT, pool_recycle=settings.DB_POOL_RECYCLE,
+                         pool_pre_ping=settings.DB_POOL_PRE_PING)
+engine = create_engine(settings.DATABASE_URL, **engine_kwargs)
+if SQLITE_PRODUCAO:
+    configurar_sqlite(engine)
+engine_escrita = engine.execution_options(escrita=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+class FilaEscrita:
+    """Fila única de escritores do SQLite (o banco aceita um por vez).
+
+    Serializa entre threads com um lock e, onde há fcntl, entre processos/workers com flock num
+    arquivo ao lado do banco: quem espera é acordado na liberação, em vez de depender do polling
+    do busy_timeout, que sob carga deixa um worker sem vez. Leituras (WAL) não passam por aqui.
+    """
+
+    def __init__(self, caminho_lock: Optional[str]):
+        self.caminho_lock = caminho_lock
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def _arquivo(self):
+        if self._pid != os.getpid():  # abre por processo: um fd herdado dividiria o flock
+            self._fd = os.open(self.caminho_lock, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def adquirir(self):
+        self._lock.acquire()
+        if fcntl and self.caminho_lock:
+            fcntl.flock(self._arquivo(), fcntl.LOCK_EX)
+
+    def liberar(self):
+        if fcntl and self.caminho_lock:
+            fcntl.flock(self._arquivo(), fcntl.LOCK_UN)
+        self._lock.release()  # threading.Lock pode ser liberado por outra thread (uso async)
+
+_fila_escrita = FilaEscrita(f"{make_url(settings.DATABASE_URL).database}.escrita.lock" if SQLITE_PRODUCAO else None)
+
+def _eh_escrita(request: Request) -> bool:
+    return SQLITE_PRODUCAO and request.method not in ("GET", "HEAD", "OPTIONS")
+
+def get_db(request: Request):
+    escrita = _eh_escrita(request)
+    if escrita:
+        _fila_escrita.adquirir()
+    db = SessionLocal(bind=engine_escrita) if escrita else SessionLocal()
     try:
         yield db
     finally:
         db.close()
-
-# Auth simples via header x-api-key
-def require_api_key(x_api_key: str = Header(..., alias="x-api-key")):
-    if x_api_key not in settings.API_KEYS:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key inválida")
-    return True
+        if escrita:
+            _fila_escrita.liberar()
+
+@contextmanager
+def sessao_escrita():
+    # escrita fora das rotas (middleware, tarefas): mesma fila e BEGIN IMMEDIATE do get_db
+    if SQLITE_PRODUCAO:
+        _fila_escrita.adquirir()
+    try:
+        with SessionLocal(bind=engine_escrita) as db:
+            yield db
+    finally:
+        if SQLITE_PRODUCAO:
+            _fila_escrita.liberar()
+
+def url_async(url: str) -> str:
+    # sqlite:/// -> sqlite+aiosqlite:///, postgresql:// -> postgresql+asyncpg://
+    esquema, resto = url.split("://", 1)
+    base = esquema.split("+", 1)[0]
+    if base == "sqlite": return f"sqlite+aiosqlite://{resto}"
+    if base in ("postgresql", "postgres"): return f"postgresql+asyncpg://{resto}"
+    return url
+
+async_engine = None
+AsyncSessionLocal = None
+if settings.ASYNC_DB:
+    # import só aqui: sqlalchemy.ext.asyncio pesa no startup; as rotas async anotam "AsyncSession" como string
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    async_engine = create_async_engine(url_async(settings.DATABASE_URL),
+                                       **{k: v for k, v in engine_kwargs.items() if k not in ("connect_args", "poolclass")})
+    if SQLITE_PRODUCAO:
+        configurar_sqlite(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=True)
+
+async def get_async_db(request: Request):
+    if not _eh_escrita(request):
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    await asyncio.to_thread(_fila_escrita.adquirir)
+    try:
+        async with AsyncSessionLocal(bind=async_engine.execution_options(escrita=True)) as db:
+            yield db
+    finally:
+        _fila_escrita.liberar()
 
 # =========================
 # Models (SQLAlchemy)
 # =========================
+# No SQLite o func.now() grava "YYYY-MM-DD HH:MM:SS" (sem microssegundos); sem truncar, os
+# parâmetros datetime viram "...:SS.000000" e a comparação textual (cursor, filtro de mês) erra.
+DataHora = DateTime().with_variant(SQLITE_DATETIME(truncate_microseconds=True), "sqlite")
+# dinheiro exato no banco (NUMERIC; no Postgres, sem erro de ponto flutuante em somas e relatórios),
+# mas lido como float: a API e as contas em Python continuam como estavam
+Dinheiro = Numeric(14, 2, asdecimal=False)
+Preco = Numeric(14, 4, asdecimal=False)
+
 class OrderStatus(str, Enum):
     RASCUNHO = "rascunho"
     PENDENTE_APROVACAO = "pendente_aprovacao"
@@ -79,12 +351,15 @@ class Produto(Base):
     nome: Mapped[str] = mapped_column(String)
     unidade_medida: Mapped[str] = mapped_column(String, default="UN")
     fornecedor_id: Mapped[int] = mapped_column(ForeignKey("fornecedores.id"))
-    preco: Mapped[float] = mapped_column(Float, default=0.0)
+    preco: Mapped[float] = mapped_column(Preco, default=0.0)
     ativo: Mapped[bool] = mapped_column(Boolean, default=True)
     fornecedor: Mapped[Fornecedor] = relationship("Fornecedor")
 
 class Limite(Base):
     __tablename__ = "limites"
+    __table_args__ = (
+        Index("ux_limites_unidade_produto", "unidade_id", "produto_id", unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     unidade_id: Mapped[int] = mapped_column(ForeignKey("unidades.id"))
     produto_id: Mapped[int] = mapped_column(ForeignKey("produtos.id"))
@@ -95,8 +370,17 @@ class Limite(Base):
 
 class Pedido(Base):
     __tablename__ = "pedidos"
+    __table_args__ = (
+        # cobrem os filtros de listar_pedidos + ordenação por criado_em (keyset)
+        Index("ix_pedidos_unidade_status_criado", "unidade_id", "status", "criado_em"),
+        Index("ix_pedidos_fornecedor_criado", "fornecedor_id", "criado_em"),
+        Index("ix_pedidos_criado_id", "criado_em", "id"),
+        # /pedidos/changes (sincronização incremental, geral ou por loja)
+        Index("ix_pedidos_versao", "versao"),
+        Index("ix_pedidos_unidade_versao", "unidade_id", "versao"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    criado_em: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    criado_em: Mapped[datetime] = mapped_column(DataHora, default=func.now())
     unidade_id: Mapped[int] = mapped_column(ForeignKey("unidades.id"))
     gerente_nome: Mapped[str] = mapped_column(String)
     contato: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -104,22 +388,26 @@ class Pedido(Base):
     status: Mapped[OrderStatus] = mapped_column(SAEnum(OrderStatus), default=OrderStatus.RASCUNHO)
     desejado_para: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
     observacoes: Mapped[Optional[str]] = mapped_column(String, nullable=True)
-    valor_total: Mapped[float] = mapped_column(Float, default=0.0)
+    valor_total: Mapped[float] = mapped_column(Dinheiro, default=0.0)
+    versao: Mapped[int] = mapped_column(Integer, default=0)  # sequência de mudanças (ver _versionar_pedidos)
 
     unidade: Mapped[Unidade] = relationship("Unidade")
     fornecedor: Mapped[Fornecedor] = relationship("Fornecedor")
-    itens: Mapped[List["ItemPedido"]] = relationship("ItemPedido", cascade="all, delete-orphan", back_populates="pedido")
+    itens: Mapped[List["ItemPedido"]] = relationship("ItemPedido", cascade="all, delete-orphan", back_populates="pedido",
+                                                     order_by="ItemPedido.id")
     aprovacoes: Mapped[List["Aprovacao"]] = relationship("Aprovacao", cascade="all, delete-orphan", back_populates="pedido")
     recebimentos: Mapped[List["Recebimento"]] = relationship("Recebimento", cascade="all, delete-orphan", back_populates="pedido")
 
 class ItemPedido(Base):
     __tablename__ = "itens_pedido"
+    # itens por pedido (selectinload, listagem, exclusão em cascata) sem varrer a tabela
+    __table_args__ = (Index("ix_itens_pedido_pedido", "pedido_id", "id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     pedido_id: Mapped[int] = mapped_column(ForeignKey("pedidos.id"))
     produto_id: Mapped[int] = mapped_column(ForeignKey("produtos.id"))
     quantidade: Mapped[float] = mapped_column(Float)
-    preco: Mapped[float] = mapped_column(Float)
-    subtotal: Mapped[float] = mapped_column(Float)
+    preco: Mapped[float] = mapped_column(Preco)
+    subtotal: Mapped[float] = mapped_column(Dinheiro)
     motivo: Mapped[Optional[str]] = mapped_column(String, nullable=True)
 
     pedido: Mapped[Pedido] = relationship("Pedido", back_populates="itens")
@@ -144,7 +432,88 @@ class Recebimento(Base):
     divergencia: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     pedido: Mapped[Pedido] = relationship("Pedido", back_populates="recebimentos")
 
-Base.metadata.create_all(engine)
+class PedidoRemovido(Base):
+    # tombstones para /pedidos/changes: quem sincroniza por versão precisa saber o que foi excluído
+    __tablename__ = "pedidos_removidos"
+    __table_args__ = (
+        Index("ix_pedidos_removidos_versao", "versao"),
+        Index("ix_pedidos_removidos_unidade_versao", "unidade_id", "versao"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    pedido_id: Mapped[int] = mapped_column(Integer)
+    unidade_id: Mapped[int] = mapped_column(Integer)
+    versao: Mapped[int] = mapped_column(Integer)
+    removido_em: Mapped[datetime] = mapped_column(DataHora, default=func.now())
+
+class Sequencia(Base):
+    __tablename__ = "sequencias"
+    nome: Mapped[str] = mapped_column(String, primary_key=True)
+    valor: Mapped[int] = mapped_column(Integer, default=0)
+
+class ApiKey(Base):
+    # só o hash SHA-256 é gravado; a chave em claro aparece uma única vez, na criação
+    __tablename__ = "api_keys"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    nome: Mapped[str] = mapped_column(String)
+    hash: Mapped[str] = mapped_column(String, unique=True)
+    admin: Mapped[bool] = mapped_column(Boolean, default=False)
+    ativa: Mapped[bool] = mapped_column(Boolean, default=True)
+    limite_rps: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    rajada: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    criada_em: Mapped[datetime] = mapped_column(DataHora, default=func.now())
+
+class Idempotencia(Base):
+    # respostas guardadas por (API key, Idempotency-Key); ver IdempotenciaMiddleware
+    __tablename__ = "idempotencia"
+    __table_args__ = (
+        Index("ux_idempotencia_chave", "escopo", "chave", unique=True),
+        Index("ix_idempotencia_expira", "expira_em"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    escopo: Mapped[str] = mapped_column(String)  # hash da API key
+    chave: Mapped[str] = mapped_column(String)
+    digest: Mapped[str] = mapped_column(String)  # método + caminho + corpo da requisição original
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # None: ainda executando
+    media_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    corpo: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    expira_em: Mapped[float] = mapped_column(Float)  # epoch
+
+class EnvioFornecedor(Base):
+    # outbox do envio ao fornecedor: gravado na mesma transação que autoriza o pedido e drenado
+    # pelo DespachoFornecedores; sem FK para o pedido poder ser excluído com envio na fila
+    __tablename__ = "envios_fornecedor"
+    __table_args__ = (
+        Index("ix_envios_fornecedor_fila", "status", "proxima_tentativa"),
+        Index("ix_envios_fornecedor_pedido", "pedido_id"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    pedido_id: Mapped[int] = mapped_column(Integer)
+    fornecedor_id: Mapped[int] = mapped_column(Integer)
+    status: Mapped[str] = mapped_column(String, default="pendente")  # pendente | enviado | falhou | cancelado
+    tentativas: Mapped[int] = mapped_column(Integer, default=0)
+    proxima_tentativa: Mapped[float] = mapped_column(Float, default=time.time)  # epoch
+    ultimo_erro: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    criado_em: Mapped[datetime] = mapped_column(DataHora, default=func.now())
+    enviado_em: Mapped[Optional[datetime]] = mapped_column(DataHora, nullable=True)
+
+class ResumoGasto(Base):
+    # agregado por mês/unidade/fornecedor/produto/status, mantido incrementalmente (ver somar_resumo)
+    __tablename__ = "resumo_gastos"
+    __table_args__ = (
+        Index("ux_resumo_gastos_chave", "ano", "mes", "unidade_id", "fornecedor_id", "produto_id", "status", unique=True),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ano: Mapped[int] = mapped_column(Integer)
+    mes: Mapped[int] = mapped_column(Integer)
+    unidade_id: Mapped[int] = mapped_column(ForeignKey("unidades.id"))
+    fornecedor_id: Mapped[int] = mapped_column(ForeignKey("fornecedores.id"))
+    produto_id: Mapped[int] = mapped_column(ForeignKey("produtos.id"))
+    status: Mapped[OrderStatus] = mapped_column(SAEnum(OrderStatus))
+    quantidade: Mapped[float] = mapped_column(Float, default=0.0)
+    valor: Mapped[float] = mapped_column(Dinheiro, default=0.0)
+    itens: Mapped[int] = mapped_column(Integer, default=0)
+
+# o schema é criado/atualizado pelas migrations em migrations/ (ver preparar_banco)
 
 # =========================
 # Schemas (Pydantic)
@@ -241,6 +610,356 @@ class RecebimentoIn(BaseModel):
     quantidade_recebida: float = Field(gt=0)
     divergencia: Optional[str] = None
 
+class GastoOut(BaseModel):
+    ano: Optional[int] = None
+    mes: Optional[int] = None
+    unidade_id: Optional[int] = None
+    fornecedor_id: Optional[int] = None
+    produto_id: Optional[int] = None
+    quantidade: float
+    valor: float
+    itens: int
+
+class PedidosBulkIn(BaseModel):
+    pedidos: List[PedidoIn] = Field(min_length=1, max_length=5000)
+    atomico: bool = False  # True = tudo ou nada
+
+class EnviarLoteIn(BaseModel):
+    pedido_ids: List[int] = Field(min_length=1, max_length=5000)
+
+class EnvioResultado(BaseModel):
+    pedido_id: int
+    ok: bool
+    status: Optional[OrderStatus] = None
+    erro: Optional[str] = None
+
+class PedidoBulkResultado(BaseModel):
+    indice: int
+    ok: bool
+    pedido_id: Optional[int] = None
+    valor_total: Optional[float] = None
+    erro: Optional[str] = None
+
+class AprovacaoOut(BaseModel):
+    id: int
+    decisor: str
+    aprovado: bool
+    motivo: Optional[str]
+    carimbo: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class RecebimentoOut(BaseModel):
+    id: int
+    data_recebimento: date
+    quantidade_recebida: float
+    divergencia: Optional[str]
+    model_config = ConfigDict(from_attributes=True)
+
+class PedidoSyncOut(PedidoOut):
+    versao: int
+    aprovacoes: List[AprovacaoOut]
+    recebimentos: List[RecebimentoOut]
+
+class RemovidoOut(BaseModel):
+    pedido_id: int
+    unidade_id: int
+    versao: int
+    model_config = ConfigDict(from_attributes=True)
+
+class MudancasOut(BaseModel):
+    pedidos: List[PedidoSyncOut]
+    removidos: List[RemovidoOut]
+    cursor: int
+    mais: bool
+
+class ApiKeyIn(BaseModel):
+    nome: str
+    admin: bool = False
+    limite_rps: Optional[float] = Field(None, gt=0)  # None = RATE_LIMIT_RPS
+    rajada: Optional[int] = Field(None, ge=1)  # None = RATE_LIMIT_RAJADA
+
+class ApiKeyOut(ApiKeyIn):
+    id: int
+    ativa: bool
+    criada_em: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class ApiKeyCriada(ApiKeyOut):
+    chave: str  # em claro, só nesta resposta
+
+class SugestaoOut(BaseModel):
+    unidade_id: int
+    fornecedor_id: int
+    produto_id: int
+    quantidade: float  # sugerida, já dentro do Limite da unidade
+    consumo_diario: float
+    em_aberto: float  # em pedidos ainda não recebidos (rascunho inclusive)
+    cobertura_dias: float  # sla_dias + SUGESTAO_CICLO_DIAS
+    minimo: Optional[float] = None
+    maximo: Optional[float] = None
+
+class SugestaoRascunhosIn(BaseModel):
+    unidade_ids: Optional[List[int]] = None  # None = todas as unidades ativas
+    gerente_nome: str = "sugestão automática"
+
+class EnvioOut(BaseModel):
+    id: int
+    pedido_id: int
+    fornecedor_id: int
+    status: Literal["pendente", "enviado", "falhou", "cancelado"]
+    tentativas: int
+    proxima_tentativa: float  # epoch
+    ultimo_erro: Optional[str] = None
+    criado_em: datetime
+    enviado_em: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+# =========================
+# Cache de cadastros
+# =========================
+class CatalogoCache:
+    """Cache em memória (LRU + TTL) de unidades, fornecedores e produtos, que mudam pouco.
+
+    Cada tabela tem uma versão; os endpoints de cadastro chamam `invalidar`, que descarta as
+    entradas da tabela e impede que uma carga iniciada antes da invalidação seja gravada.
+    """
+
+    def __init__(self, max_itens: int, ttl: float):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens: OrderedDict = OrderedDict()
+        self._versoes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def obter(self, tabela: str, chave, carregar: Callable):
+        k = (tabela, chave)
+        with self._lock:
+            versao = self._versoes.get(tabela, 0)
+            hit = self._itens.get(k)
+            if hit and hit[0] == versao and time.monotonic() - hit[1] < self.ttl:
+                self._itens.move_to_end(k)
+                return hit[2]
+        valor = carregar()
+        if valor is None:
+            return None  # ausências não são cacheadas
+        with self._lock:
+            if self._versoes.get(tabela, 0) == versao:
+                self._itens[k] = (versao, time.monotonic(), valor)
+                self._itens.move_to_end(k)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+        return valor
+
+    def invalidar(self, tabela: str):
+        with self._lock:
+            self._versoes[tabela] = self._versoes.get(tabela, 0) + 1
+            for k in [k for k in self._itens if k[0] == tabela]:
+                del self._itens[k]
+
+catalogo = CatalogoCache(settings.CATALOGO_CACHE_MAX, settings.CATALOGO_CACHE_TTL)
+
+_ADAPTERS = {
+    "unidades": TypeAdapter(List[UnidadeOut]),
+    "fornecedores": TypeAdapter(List[FornecedorOut]),
+    "produtos": TypeAdapter(List[ProdutoOut]),
+}
+
+def cadastro_por_id(db: Session, modelo, schema, pk: int):
+    # guarda o schema Out (snapshot), nunca o objeto ORM preso à sessão
+    def _carregar():
+        obj = db.get(modelo, pk)
+        return schema.model_validate(obj) if obj else None
+    return catalogo.obter(modelo.__tablename__, ("id", pk), _carregar)
+
+def lista_cacheada(tabela: str, chave, carregar: Callable, if_none_match: Optional[str]) -> Response:
+    def _serializar():
+        adapter = _ADAPTERS[tabela]
+        body = adapter.dump_json(adapter.validate_python(carregar(), from_attributes=True))
+        return body, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+    body, etag = catalogo.obter(tabela, ("lista", chave), _serializar)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    aceitas = [t.strip().removeprefix("W/") for t in (if_none_match or "").split(",")]
+    if etag in aceitas or "*" in aceitas:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# =========================
+# Autenticação & rate limit
+# =========================
+def hash_chave(chave: str) -> str:
+    # chaves são tokens aleatórios longos: SHA-256 basta e mantém a verificação barata
+    return hashlib.sha256(chave.encode()).hexdigest()
+
+class ChavesApi:
+    """Chaves de API ativas, lidas do banco e mantidas em memória.
+
+    A tabela (são poucas chaves) é recarregada quando passa o TTL ou logo após uma mudança via
+    /api-keys, então criar/revogar chaves não exige reinício. O rate limit é um token bucket
+    por chave, em memória (por processo).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._chaves: dict[str, ApiKeyOut] = {}
+        self._carregado_em = float("-inf")
+        self._recarga: Optional[asyncio.Future] = None
+        self._baldes: dict[int, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def recarregar(self):
+        with SessionLocal() as db:
+            chaves = {k.hash: ApiKeyOut.model_validate(k) for k in db.scalars(select(ApiKey).where(ApiKey.ativa))}
+        self._chaves, self._carregado_em = chaves, time.monotonic()
+
+    async def garantir(self):
+        if time.monotonic() - self._carregado_em < self.ttl:
+            return
+        # uma recarga por vez, fora do event loop; quem chega enquanto isso aguarda a mesma
+        loop = asyncio.get_running_loop()
+        if self._recarga is None or self._recarga.done() or self._recarga.get_loop() is not loop:
+            self._recarga = loop.run_in_executor(None, self.recarregar)
+        await self._recarga
+
+    def invalidar(self):
+        self._carregado_em = float("-inf")
+
+    def buscar(self, chave: str) -> Optional[ApiKeyOut]:
+        return self._chaves.get(hash_chave(chave))
+
+    def consumir(self, chave: ApiKeyOut) -> float:
+        """Tira uma ficha do balde da chave; devolve 0 ou os segundos até a próxima ficha."""
+        taxa = chave.limite_rps or settings.RATE_LIMIT_RPS
+        if not taxa:
+            return 0.0
+        rajada = chave.rajada or settings.RATE_LIMIT_RAJADA
+        with self._lock:
+            agora = time.monotonic()
+            fichas, ultimo = self._baldes.get(chave.id, (rajada, agora))
+            fichas = min(rajada, fichas + (agora - ultimo) * taxa)
+            if fichas >= 1:
+                self._baldes[chave.id] = (fichas - 1, agora)
+                return 0.0
+            self._baldes[chave.id] = (fichas, agora)
+            return (1 - fichas) / taxa
+
+chaves_api = ChavesApi(settings.API_KEYS_CACHE_TTL)
+
+def garantir_chaves_settings(db: Session):
+    # chaves de settings.API_KEYS valem sempre como admin (as revogadas continuam revogadas)
+    existentes = set(db.scalars(select(ApiKey.hash)))
+    for chave in dict.fromkeys(settings.API_KEYS):
+        if hash_chave(chave) not in existentes:
+            db.add(ApiKey(nome="settings", hash=hash_chave(chave), admin=True))
+    try:
+        db.commit()
+    except IntegrityError:  # outro processo subindo ao mesmo tempo já gravou as mesmas chaves
+        db.rollback()
+
+# Auth via header x-api-key. Dependência async: roda no event loop, então chave inválida ou
+# acima do limite é recusada sem ocupar uma thread do threadpool nem a fila de escrita.
+async def require_api_key(request: Request, x_api_key: str = Header(..., alias="x-api-key")) -> ApiKeyOut:
+    await chaves_api.garantir()
+    chave = chaves_api.buscar(x_api_key)
+    if not chave:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key inválida")
+    # o IdempotenciaMiddleware já tira a ficha antes de reservar a chave: não cobra duas vezes
+    espera = 0.0 if getattr(request.state, "api_key", None) is not None else chaves_api.consumir(chave)
+    if espera:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Limite de requisições excedido",
+                            headers={"Retry-After": str(math.ceil(espera))})
+    request.state.api_key = chave
+    return chave
+
+async def require_admin(chave: ApiKeyOut = Depends(require_api_key)) -> ApiKeyOut:
+    if not chave.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="API key sem permissão de administração")
+    return chave
+
+# =========================
+# Eventos de pedidos (SSE)
+# =========================
+class EventosPedidos:
+    """Broadcaster em processo das mudanças de pedidos para as conexões de /pedidos/eventos.
+
+    As rotas acumulam os eventos na sessão (`registrar_evento`); só depois do commit eles são
+    numerados e entregues. Os últimos eventos ficam num buffer circular para que um cliente que
+    reconecta com Last-Event-ID receba o que perdeu. Os ids carregam a marca da execução: ids de
+    outro processo/reinício não são retomáveis e o cliente recebe `reset` (recarregar a lista).
+    """
+
+    def __init__(self, tamanho: int, fila: int):
+        self.fila = fila
+        self._boot = format(time.time_ns(), "x")
+        self._seq = 0
+        self._recentes: deque = deque(maxlen=tamanho)
+        self._assinantes: set = set()
+        self._lock = threading.Lock()
+
+    def publicar(self, eventos: list[dict]):
+        # chamado da thread da rota (sync) ou do loop (run_sync); a entrega é sempre no loop do assinante
+        with self._lock:
+            numerados = []
+            for e in eventos:
+                self._seq += 1
+                numerados.append((f"{self._boot}-{self._seq}", e))
+            self._recentes.extend(numerados)
+            assinantes = list(self._assinantes)
+        for loop, fila in assinantes:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fila, numerados)
+            except RuntimeError:  # loop já encerrado
+                pass
+
+    @staticmethod
+    def _entregar(fila: asyncio.Queue, numerados: list):
+        for item in numerados:
+            if fila.full():
+                # cliente lento: encerra o stream e ele retoma pelo Last-Event-ID
+                while not fila.empty():
+                    fila.get_nowait()
+                fila.put_nowait(None)
+                return
+            fila.put_nowait(item)
+
+    def assinar(self, ultimo_id: Optional[str]) -> tuple[tuple, list, bool]:
+        """Registra um assinante; devolve (assinatura, eventos perdidos desde ultimo_id, reset?)."""
+        assinatura = (asyncio.get_running_loop(), asyncio.Queue(self.fila))
+        with self._lock:
+            perdidos, reset = [], False
+            if ultimo_id:
+                boot, _, seq = ultimo_id.partition("-")
+                if boot != self._boot or not seq.isdigit() or int(seq) > self._seq:
+                    reset = True
+                else:
+                    seq = int(seq)
+                    primeiro = int(self._recentes[0][0].partition("-")[2]) if self._recentes else self._seq + 1
+                    reset = seq < primeiro - 1  # já saiu do buffer
+                    perdidos = [(i, e) for i, e in self._recentes if int(i.partition("-")[2]) > seq]
+            self._assinantes.add(assinatura)
+        return assinatura, perdidos, reset
+
+    def cancelar(self, assinatura: tuple):
+        with self._lock:
+            self._assinantes.discard(assinatura)
+
+eventos_pedidos = EventosPedidos(settings.EVENTOS_BUFFER, settings.EVENTOS_FILA)
+
+def registrar_evento(db: Session, tipo: str, pedido: Pedido):
+    db.info.setdefault("eventos", []).append(dict(
+        tipo=tipo, pedido_id=pedido.id, unidade_id=pedido.unidade_id, status=pedido.status.value,
+        valor_total=pedido.valor_total))
+
+@event.listens_for(Session, "after_commit")
+def _publicar_eventos(db: Session):
+    eventos = db.info.pop("eventos", None)
+    if eventos:
+        eventos_pedidos.publicar(eventos)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_eventos(db: Session):
+    db.info.pop("eventos", None)
+
 # =========================
 # Helpers de negócios
 # =========================
@@ -250,17 +969,881 @@ def calcular_total(pedido: Pedido):
         total += it.subtotal
     pedido.valor_total = round(total, 2)
 
+IN_LOTE = 500  # fica abaixo do limite de parâmetros do SQLite
+
+RESUMO_CHAVE = ("ano", "mes", "unidade_id", "fornecedor_id", "produto_id", "status")
+
+def linhas_resumo(criado_em: datetime, unidade_id: int, fornecedor_id: int, status: OrderStatus,
+                  itens, sinal: int) -> list[dict]:
+    # itens: iterável de (produto_id, quantidade, subtotal)
+    return [dict(ano=criado_em.year, mes=criado_em.month, unidade_id=unidade_id, fornecedor_id=fornecedor_id,
+                 produto_id=produto_id, status=status, quantidade=sinal * quantidade, valor=sinal * subtotal,
+                 itens=sinal)
+            for produto_id, quantidade, subtotal in itens]
+
+def registrar_resumo(db: Session, pedido: Pedido, sinal: int):
+    # acumula na sessão; o upsert agregado acontece uma vez só, no commit (_gravar_resumo)
+    db.info.setdefault("resumo", []).extend(linhas_resumo(
+        pedido.criado_em, pedido.unidade_id, pedido.fornecedor_id, pedido.status,
+        ((it.produto_id, it.quantidade, it.subtotal) for it in pedido.itens), sinal))
+
+def mudar_status(db: Session, pedido: Pedido, novo: OrderStatus):
+    if pedido.status == novo:
+        return
+    registrar_resumo(db, pedido, -1)
+    pedido.status = novo
+    registrar_resumo(db, pedido, +1)
+    registrar_evento(db, "status", pedido)
+    if novo == OrderStatus.AUTORIZADO and settings.ENVIO_MODO != "desligado":
+        # outbox: o envio ao fornecedor só existe se a autorização for commitada (ver DespachoFornecedores).
+        # Com o despacho desligado nada é enfileirado: ligá-lo depois não manda pedidos antigos de uma vez
+        db.add(EnvioFornecedor(pedido_id=pedido.id, fornecedor_id=pedido.fornecedor_id))
+        db.info["envios"] = True
+
+def somar_resumo(db: Session, linhas: list[dict]):
+    agregado: dict[tuple, dict] = {}
+    for ln in linhas:
+        k = tuple(ln[c] for c in RESUMO_CHAVE)
+        acc = agregado.setdefault(k, dict(ln, quantidade=0.0, valor=0.0, itens=0))
+        acc["quantidade"] += ln["quantidade"]; acc["valor"] += ln["valor"]; acc["itens"] += ln["itens"]
+    deltas = [d for d in agregado.values() if d["itens"] or d["quantidade"] or d["valor"]]
+    if not deltas:
+        return
+    t = ResumoGasto.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        ins = pg_insert(t)
+    else:
+        ins = sqlite_insert(t)
+    db.execute(ins.on_conflict_do_update(
+        index_elements=list(RESUMO_CHAVE),
+        set_={"quantidade": t.c.quantidade + ins.excluded.quantidade,
+              "valor": t.c.valor + ins.excluded.valor,
+              "itens": t.c.itens + ins.excluded.itens},
+    ), deltas)
+    zerados = [{f"k_{c}": d[c] for c in RESUMO_CHAVE} for d in deltas if d["itens"] < 0]
+    if zerados:
+        # só nas chaves que diminuíram (pelo índice único), nunca varrendo o resumo inteiro
+        db.execute(delete(t).where(*(t.c[c] == bindparam(f"k_{c}") for c in RESUMO_CHAVE), t.c.itens <= 0), zerados)
+
+@event.listens_for(Session, "before_commit")
+def _gravar_resumo(db: Session):
+    linhas = db.info.pop("resumo", None)
+    if linhas:
+        somar_resumo(db, linhas)
+        db.info["resumo_gravado"] = linhas  # vai para as estatísticas de consumo depois do commit
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_resumo(db: Session):
+    db.info.pop("resumo", None)
+    db.info.pop("resumo_gravado", None)
+
+def reservar_versoes(db: Session, n: int) -> int:
+    """Reserva n números da sequência de mudanças dos pedidos e devolve o primeiro.
+
+    O UPDATE trava a linha do contador até o commit, então as versões ficam visíveis na mesma
+    ordem em que foram reservadas e /pedidos/changes nunca pula uma mudança ainda não commitada.
+    Por isso a reserva fica para o commit (_reservar_versoes), uma vez por transação.
+    """
+    t = Sequencia.__table__
+    fim = db.connection().execute(
+        update(t).where(t.c.nome == "pedidos").values(valor=t.c.valor + n).returning(t.c.valor)
+    ).scalar_one()
+    return fim - n + 1
+
+def anotar_versionar(db: Session):
+    # todo pedido criado/alterado (inclusive itens, aprovações e recebimentos) ganha uma versão
+    # nova; excluídos viram tombstone com a versão da exclusão. Aqui só anota: a versão sai no commit
+    alterados, removidos = db.info.setdefault("versionar", ({}, {}))
+    with db.no_autoflush:
+        for o in db.deleted:
+            if isinstance(o, Pedido):
+                removidos[o.id] = o
+        for o in list(db.new) + [o for o in db.dirty if db.is_modified(o)] + list(db.deleted):
+            if isinstance(o, Pedido):
+                pedido = o
+            elif isinstance(o, (ItemPedido, Aprovacao, Recebimento)):
+                pedido = o.pedido or (db.get(Pedido, o.pedido_id) if o.pedido_id else None)
+            else:
+                continue
+            if pedido is not None:
+                alterados[id(pedido)] = pedido
+
+@event.listens_for(Session, "before_flush")
+def _versionar_pedidos(db: Session, flush_context, instances):
+    if not db.info.get("versoes_reservadas"):  # no flush do commit as versões já foram atribuídas
+        anotar_versionar(db)
+
+@event.listens_for(Session, "before_commit")
+def _reservar_versoes(db: Session):
+    # a linha do contador fica travada só do último flush até o COMMIT, não a requisição inteira;
+    # as versões entram no mesmo INSERT/UPDATE que o flush do commit já faria
+    anotar_versionar(db)  # mudanças ainda não enviadas ao banco
+    alterados, removidos = db.info.pop("versionar")
+    inseridos = db.info.pop("versionar_ids", [])  # pedidos gravados via Core (criar_pedidos_bulk)
+    alterados = [p for p in alterados.values() if p.id is None or p.id not in removidos]
+    if not alterados and not removidos and not inseridos:
+        return
+    db.info["versoes_reservadas"] = True
+    versao = reservar_versoes(db, len(alterados) + len(removidos) + len(inseridos))
+    for pedido in alterados:
+        pedido.versao = versao; versao += 1
+    for pedido in removidos.values():
+        db.add(PedidoRemovido(pedido_id=pedido.id, unidade_id=pedido.unidade_id, versao=versao)); versao += 1
+    if inseridos:
+        t = Pedido.__table__
+        db.connection().execute(update(t).where(t.c.id == bindparam("k_id")).values(versao=bindparam("k_versao")),
+                                [dict(k_id=pid, k_versao=versao + i) for i, pid in enumerate(inseridos)])
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _limpar_versoes(db: Session):
+    db.info.pop("versionar", None)
+    db.info.pop("versionar_ids", None)
+    db.info.pop("versoes_reservadas", None)
+
+def reconstruir_resumo(db: Session):
+    # recalcula tudo a partir de pedidos/itens (bancos que já tinham pedidos antes do resumo)
+    t = ResumoGasto.__table__
+    db.execute(delete(t))
+    ano, mes = extract("year", Pedido.criado_em), extract("month", Pedido.criado_em)
+    agregado = (
+        select(ano, mes, Pedido.unidade_id, Pedido.fornecedor_id, ItemPedido.produto_id, Pedido.status,
+               func.sum(ItemPedido.quantidade), func.sum(ItemPedido.subtotal), func.count(ItemPedido.id))
+        .join(ItemPedido, ItemPedido.pedido_id == Pedido.id)
+        .group_by(ano, mes, Pedido.unidade_id, Pedido.fornecedor_id, ItemPedido.produto_id, Pedido.status)
+    )
+    db.execute(insert(t).from_select(list(RESUMO_CHAVE) + ["quantidade", "valor", "itens"], agregado))
+    db.commit()
+    consumo.invalidar()
+
+def buscar_por_ids(db: Session, colunas, chave, ids) -> dict:
+    # resolve muitos ids com poucas consultas IN (em lotes), devolvendo {id: row}
+    ids = sorted(set(ids))
+    achados = {}
+    for i in range(0, len(ids), IN_LOTE):
+        for row in db.execute(select(*colunas).where(chave.in_(ids[i:i + IN_LOTE]))):
+            achados[row[0]] = row
+    return achados
+
+def pedidos_fora_do_limite(db: Session, pedido_ids) -> set[int]:
+    # um único join itens x limites (por unidade do pedido) para o lote inteiro
+    fora = set()
+    ids = sorted(set(pedido_ids))
+    for i in range(0, len(ids), IN_LOTE):
+        stmt = (
+            select(ItemPedido.pedido_id).distinct()
+            .join(Pedido, Pedido.id == ItemPedido.pedido_id)
+            .join(Limite, (Limite.unidade_id == Pedido.unidade_id) & (Limite.produto_id == ItemPedido.produto_id))
+            .where(ItemPedido.pedido_id.in_(ids[i:i + IN_LOTE]),
+                   or_(ItemPedido.quantidade < Limite.minimo, ItemPedido.quantidade > Limite.maximo))
+        )
+        fora.update(db.scalars(stmt))
+    return fora
+
 def validar_limites(db: Session, pedido: Pedido) -> bool:
-    precisa_aprovacao = False
-    for it in pedido.itens:
-        lim = db.query(Limite).filter(
-            Limite.unidade_id == pedido.unidade_id,
-            Limite.produto_id == it.produto_id
-        ).one_or_none()
-        if lim:
-            if it.quantidade < lim.minimo or it.quantidade > lim.maximo:
-                precisa_aprovacao = True
-    return precisa_aprovacao
+    return pedido.id in pedidos_fora_do_limite(db, [pedido.id])
+
+# =========================
+# Sugestão de reposição
+# =========================
+# numpy é importado dentro das funções: só entra no processo quando a sugestão é usada
+STATUS_EM_ABERTO = (OrderStatus.RASCUNHO, OrderStatus.PENDENTE_APROVACAO, OrderStatus.APROVADO, OrderStatus.AUTORIZADO)
+
+def mes_indice(ano: int, mes: int) -> int:
+    return ano * 12 + mes - 1
+
+def matriz(db: Session, stmt, dtype="float64") -> "np.ndarray":
+    import numpy as np
+    # Core (sem a carga do ORM) e tuplas puras: np.array sobre Row consulta __array__ linha a linha
+    linhas = db.connection().execute(stmt).fetchall()
+    return np.array([tuple(ln) for ln in linhas], dtype=dtype).reshape(-1, len(stmt.selected_columns))
+
+class EstatisticasConsumo:
+    """Consumo por (unidade, produto) em arrays NumPy, para sugerir reposição sem varrer pedidos.
+
+    A fonte é o resumo_gastos, que já é mantido incrementalmente: quantidade recebida por mês
+    (status RECEBIDO, pelo mês de criação do pedido) nos últimos SUGESTAO_MESES meses fechados mais
+    o corrente, e quantidade em pedidos ainda em aberto. Monta uma vez e depois só soma os deltas
+    que cada commit grava no resumo (`registrar`). Reconstrói na virada do mês, quando aparece um
+    par (unidade, produto) novo, quando limites ou produtos mudam (`invalidar`) e a cada
+    SUGESTAO_TTL, o que também corrige commits de outros processos ou feitos durante a montagem.
+
+    O estado publicado nunca é alterado: `sugerir` lê os arrays sem o lock, então aplicar deltas
+    gera cópias de `recebido`/`aberto` num dict novo que substitui o anterior (copy-on-write).
+    """
+
+    def __init__(self, meses: int, ttl: float):
+        self.meses = meses
+        self.ttl = ttl
+        self._estado: Optional[dict] = None
+        self._deltas: list = []
+        self._lock = threading.Lock()
+
+    def invalidar(self):
+        with self._lock:
+            self._estado, self._deltas = None, []
+
+    def registrar(self, linhas: list[dict]):
+        with self._lock:
+            if self._estado is not None:
+                self._deltas.extend(linhas)
+
+    def obter(self, db: Session) -> dict:
+        hoje = date.today()
+        with self._lock:
+            est = self._estado
+            if est and (est["mes_atual"] != mes_indice(hoje.year, hoje.month) or time.monotonic() - est["montado"] > self.ttl):
+                est = None
+            if est and self._deltas:
+                deltas, self._deltas = self._deltas, []
+                est = self._estado = self._aplicar(est, deltas)
+            if est:
+                return est
+            self._estado, self._deltas = None, []
+        est = self._montar(db, hoje)
+        with self._lock:
+            self._estado = est
+        return est
+
+    def _montar(self, db: Session, hoje: date) -> dict:
+        import numpy as np
+        atual = mes_indice(hoje.year, hoje.month)
+        inicio = atual - self.meses
+        r = ResumoGasto
+        mes = r.ano * 12 + r.mes - 1
+        recebido = r.status == OrderStatus.RECEBIDO
+        dados = matriz(db, select(r.unidade_id, r.produto_id, mes, recebido, r.quantidade)
+                       .where(or_(recebido & (mes >= inicio), r.status.in_(STATUS_EM_ABERTO))))
+        produtos = matriz(db, select(Produto.id, Produto.fornecedor_id, Produto.ativo, Fornecedor.sla_dias)
+                          .join(Fornecedor, Fornecedor.id == Produto.fornecedor_id), "int64")
+        limites = matriz(db, select(Limite.unidade_id, Limite.produto_id, Limite.minimo, Limite.maximo))
+
+        # chave = unidade * base + produto: ordenar as chaves agrupa os pares por unidade
+        base = int(produtos[:, 0].max(initial=0)) + 1
+        chaves, inv = np.unique(dados[:, 0].astype(np.int64) * base + dados[:, 1].astype(np.int64), return_inverse=True)
+        est = dict(mes_atual=atual, inicio=inicio, montado=time.monotonic(), base=base, chaves=chaves,
+                   unidade=chaves // base, produto=chaves % base,
+                   recebido=np.zeros((len(chaves), self.meses + 1)), aberto=np.zeros(len(chaves)),
+                   dias=float((hoje - date(inicio // 12, inicio % 12 + 1, 1)).days + 1),
+                   fornecedor=np.zeros(base, np.int64), sla=np.zeros(base), ativo=np.zeros(base, bool),
+                   minimo=np.full(len(chaves), np.nan), maximo=np.full(len(chaves), np.nan))
+        eh_rec = dados[:, 3] == 1
+        np.add.at(est["recebido"], (inv[eh_rec], dados[eh_rec, 2].astype(np.int64) - inicio), dados[eh_rec, 4])
+        np.add.at(est["aberto"], inv[~eh_rec], dados[~eh_rec, 4])
+        est["fornecedor"][produtos[:, 0]] = produtos[:, 1]
+        est["ativo"][produtos[:, 0]] = produtos[:, 2] != 0
+        est["sla"][produtos[:, 0]] = produtos[:, 3]
+        pos, achou = self._posicoes(est, limites[:, 0].astype(np.int64), limites[:, 1].astype(np.int64))
+        est["minimo"][pos[achou]] = limites[achou, 2]
+        est["maximo"][pos[achou]] = limites[achou, 3]
+        return est
+
+    @staticmethod
+    def _posicoes(est: dict, unidades: "np.ndarray", produtos: "np.ndarray"):
+        import numpy as np
+        chaves = est["chaves"]
+        k = unidades * est["base"] + produtos
+        pos = np.minimum(np.searchsorted(chaves, k), max(len(chaves) - 1, 0))
+        achou = (produtos < est["base"]) & (chaves[pos] == k) if len(chaves) else np.zeros(len(k), bool)
+        return pos, achou
+
+    def _aplicar(self, est: dict, deltas: list[dict]) -> Optional[dict]:
+        import numpy as np
+        # None = delta de par ainda desconhecido: quem chamou remonta
+        d = np.array([(x["unidade_id"], x["produto_id"], mes_indice(x["ano"], x["mes"]) - est["inicio"],
+                       x["status"] == OrderStatus.RECEBIDO, x["status"] in STATUS_EM_ABERTO, x["quantidade"])
+                      for x in deltas], dtype=np.float64)
+        col = d[:, 2].astype(np.int64)
+        rec = (d[:, 3] == 1) & (col >= 0)
+        aberto = d[:, 4] == 1
+        pos, achou = self._posicoes(est, d[:, 0].astype(np.int64), d[:, 1].astype(np.int64))
+        if not achou[rec | aberto].all():
+            return None
+        novo = dict(est, recebido=est["recebido"].copy(), aberto=est["aberto"].copy())
+        np.add.at(novo["recebido"], (pos[rec], col[rec]), d[rec, 5])
+        np.add.at(novo["aberto"], pos[aberto], d[aberto, 5])
+        return novo
+
+consumo = EstatisticasConsumo(settings.SUGESTAO_MESES, settings.SUGESTAO_TTL)
+
+@event.listens_for(Session, "after_commit")
+def _atualizar_consumo(db: Session):
+    linhas = db.info.pop("resumo_gravado", None)
+    if linhas:
+        consumo.registrar(linhas)
+
+def sugerir(est: dict, unidade_ids: Optional[list[int]] = None) -> dict[str, "np.ndarray"]:
+    """Quantidade sugerida por (unidade, produto), vetorizada sobre todos os pares de uma vez.
+
+    consumo diário = recebido na janela / dias da janela; cobertura = sla_dias + SUGESTAO_CICLO_DIAS;
+    necessidade = consumo * cobertura + Z * desvio mensal * sqrt(cobertura / 30) - em aberto,
+    arredondada para cima e limitada ao Limite (mínimo/máximo) da unidade, quando houver.
+    """
+    import numpy as np
+    if unidade_ids is None:
+        idx = np.arange(len(est["chaves"]))
+    else:
+        u = np.unique(np.asarray(unidade_ids, dtype=np.int64))
+        ini, fim = np.searchsorted(est["unidade"], u, "left"), np.searchsorted(est["unidade"], u, "right")
+        idx = np.concatenate([np.arange(a, b) for a, b in zip(ini, fim)] or [np.zeros(0, np.int64)])
+    rec = est["recebido"][idx]
+    produto = est["produto"][idx]
+    taxa = rec.sum(axis=1) / est["dias"]
+    cobertura = est["sla"][produto] + settings.SUGESTAO_CICLO_DIAS
+    seguranca = settings.SUGESTAO_Z * rec[:, :-1].std(axis=1) * np.sqrt(cobertura / 30)
+    aberto = est["aberto"][idx]
+    necessidade = taxa * cobertura + seguranca - aberto
+    minimo, maximo = est["minimo"][idx], est["maximo"][idx]
+    quantidade = np.fmin(np.fmax(np.ceil(necessidade), minimo), maximo)  # fmax/fmin ignoram NaN (sem limite)
+    sugerir_ = (necessidade > 0) & est["ativo"][produto] & (quantidade > 0)
+    ordem = np.lexsort((produto[sugerir_], est["fornecedor"][produto][sugerir_], est["unidade"][idx][sugerir_]))
+    return {nome: v[sugerir_][ordem] for nome, v in dict(
+        unidade_id=est["unidade"][idx], fornecedor_id=est["fornecedor"][produto], produto_id=produto,
+        quantidade=quantidade, consumo_diario=taxa, em_aberto=aberto, cobertura_dias=cobertura,
+        minimo=minimo, maximo=maximo).items()}
+
+# =========================
+# Instrumentação
+# =========================
+# Cada requisição carrega um contexto (ContextVar) que os eventos do engine alimentam com
+# contagem/tempo de SQL; o contexto é copiado para o threadpool das rotas sync e para o
+# run_sync das async.
+_ctx_requisicao: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("mqc_requisicao", default=None)
+SLOW_SQL_MAX = 200  # comandos guardados por requisição para o log de lentas
+
+def _contar_sql(statement: str, dur: float):
+    ctx = _ctx_requisicao.get()
+    if ctx is None:
+        return
+    ctx["sql_n"] += 1
+    ctx["sql_s"] += dur
+    if ctx["sql"] is not None and len(ctx["sql"]) < SLOW_SQL_MAX:
+        ctx["sql"].append((statement, dur))
+
+# o início fica no contexto de execução (um por comando), não na conexão: um comando que falha
+# não dispara after_cursor_execute e não pode deixar sobra para o próximo
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.mqc_t0 = time.perf_counter()
+
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "mqc_t0", None)
+    if t0 is not None:
+        _contar_sql(statement, time.perf_counter() - t0)
+
+def _erro_sql(erro):
+    # lock timeout, violação de constraint...: entra no tempo da requisição e em mqc_sql_errors_total
+    t0 = getattr(erro.execution_context, "mqc_t0", None)
+    if t0 is None:
+        return
+    _contar_sql(f"{erro.statement}  -- {type(erro.original_exception).__name__}", time.perf_counter() - t0)
+    SQL_ERROS.observar(1, erro=type(erro.original_exception).__name__)
+
+for _eng in [engine] + ([async_engine.sync_engine] if async_engine else []):
+    event.listen(_eng, "before_cursor_execute", _antes_sql)
+    event.listen(_eng, "after_cursor_execute", _depois_sql)
+    event.listen(_eng, "handle_error", _erro_sql)
+
+class MetricasMiddleware:
+    """Mede latência, SQL por requisição e, com SLOW_REQUEST_MS, loga as lentas com seu SQL."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        ctx = {"sql_n": 0, "sql_s": 0.0, "sql": [] if settings.SLOW_REQUEST_MS is not None else None}
+        token = _ctx_requisicao.set(ctx)
+        status_code = 500
+        t0 = time.perf_counter()
+
+        async def _send(msg):
+            nonlocal status_code
+            if msg["type"] == "http.response.start":
+                status_code = msg["status"]
+            await send(msg)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _ctx_requisicao.reset(token)
+            dur = time.perf_counter() - t0
+            rota = getattr(scope.get("route"), "path", "<sem rota>")
+            metodo = scope["method"]
+            HTTP_REQUISICOES.observar(1, metodo=metodo, rota=rota, status=status_code)
+            HTTP_LATENCIA.observar(dur, metodo=metodo, rota=rota)
+            SQL_POR_REQUISICAO.observar(ctx["sql_n"], metodo=metodo, rota=rota)
+            SQL_TEMPO.observar(ctx["sql_s"], metodo=metodo, rota=rota)
+            if settings.SLOW_REQUEST_MS is not None and dur * 1000 >= settings.SLOW_REQUEST_MS:
+                self._logar_lenta(metodo, scope.get("path", rota), dur, ctx)
+
+    @staticmethod
+    def _logar_lenta(metodo, caminho, dur, ctx):
+        # agrupa comandos iguais: um SELECT repetido N vezes é a cara de um N+1
+        repetidos: dict[str, list] = {}
+        for stmt, d in ctx["sql"]:
+            acc = repetidos.setdefault(" ".join(stmt.split()), [0, 0.0])
+            acc[0] += 1; acc[1] += d
+        linhas = [f"  {n}x {t * 1000:.1f}ms  {stmt}" for stmt, (n, t) in
+                  sorted(repetidos.items(), key=lambda kv: -kv[1][0])]
+        log.warning("Requisição lenta: %s %s %.1fms, %d comandos SQL (%.1fms)\n%s", metodo, caminho, dur * 1000,
+                    ctx["sql_n"], ctx["sql_s"] * 1000, "\n".join(linhas))
+
+def exportar_metricas() -> str:
+    linhas = []
+    for m in METRICAS:
+        linhas.extend(m.exportar())
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        linhas += ["# HELP mqc_db_pool_connections Conexões do pool por estado.", "# TYPE mqc_db_pool_connections gauge",
+                   f'mqc_db_pool_connections{{estado="em_uso"}} {pool.checkedout()}',
+                   f'mqc_db_pool_connections{{estado="livres"}} {pool.checkedin()}',
+                   f'mqc_db_pool_connections{{estado="overflow"}} {max(pool.overflow(), 0)}',
+                   "# HELP mqc_db_pool_size Tamanho configurado do pool.", "# TYPE mqc_db_pool_size gauge",
+                   f"mqc_db_pool_size {pool.size()}"]
+    linhas += ["# HELP mqc_startup_seconds Inicialização deste processo por fase.", "# TYPE mqc_startup_seconds gauge"]
+    linhas += [f'mqc_startup_seconds{{fase="{fase}"}} {seg:.3f}' for fase, seg in INICIALIZACAO.items()]
+    return "\n".join(linhas) + "\n"
+
+# =========================
+# Idempotência
+# =========================
+ROTAS_IDEMPOTENTES = re.compile(r"^/pedidos(/\d+/(enviar|aprovar|recebimentos))?$")
+IDEMPOTENCIA_RESERVA = 60.0  # segundos que uma reserva sem resposta segura a chave (worker que caiu)
+IDEMPOTENCIA_LIMPEZA = 60.0  # intervalo mínimo entre limpezas de expiradas, por processo
+_ultima_limpeza = 0.0
+
+def _limpar_idempotencia(db: Session, agora: float):
+    global _ultima_limpeza
+    if agora - _ultima_limpeza < IDEMPOTENCIA_LIMPEZA:
+        return
+    _ultima_limpeza = agora
+    t = Idempotencia.__table__
+    db.execute(delete(t).where(t.c.expira_em < agora))
+    corte = db.scalar(select(t.c.id).order_by(t.c.id.desc()).offset(settings.IDEMPOTENCIA_MAX).limit(1))
+    if corte is not None:
+        db.execute(delete(t).where(t.c.id <= corte))
+
+def reservar_idempotencia(escopo: str, chave: str, digest: str):
+    """Reserva a chave para esta requisição (devolve None) ou informa o que já existe:
+    "conflito" (mesma chave, outra requisição), "ocupado" (original executando) ou a resposta
+    gravada (status, media_type, corpo)."""
+    with sessao_escrita() as db:
+        agora = time.time()
+        _limpar_idempotencia(db, agora)
+        filtro = (Idempotencia.escopo == escopo, Idempotencia.chave == chave)
+        reg = db.scalar(select(Idempotencia).where(*filtro))
+        if reg is not None and reg.expira_em < agora:
+            db.delete(reg); db.flush(); reg = None
+        if reg is None:
+            db.add(Idempotencia(escopo=escopo, chave=chave, digest=digest, expira_em=agora + IDEMPOTENCIA_RESERVA))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:  # outro processo reservou entre o select e o insert
+                db.rollback()
+                reg = db.scalar(select(Idempotencia).where(*filtro))
+                if reg is None:
+                    return "ocupado"
+        if reg.digest != digest:
+            return "conflito"
+        if reg.status_code is None:
+            return "ocupado"
+        return reg.status_code, reg.media_type, reg.corpo
+
+def gravar_idempotencia(escopo: str, chave: str, resposta: Optional[tuple]):
+    # resposta None: não guarda (5xx, auth, 429) e libera a chave para uma nova tentativa
+    t = Idempotencia.__table__
+    filtro = (t.c.escopo == escopo, t.c.chave == chave)
+    with sessao_escrita() as db:
+        if resposta is None:
+            db.execute(delete(t).where(*filtro))
+        else:
+            status_code, media_type, corpo = resposta
+            db.execute(update(t).where(*filtro).values(status_code=status_code, media_type=media_type, corpo=corpo,
+                                                       expira_em=time.time() + settings.IDEMPOTENCIA_TTL))
+        db.commit()
+
+class IdempotenciaMiddleware:
+    """Idempotency-Key em POST /pedidos e nas transições enviar/aprovar/recebimentos.
+
+    A primeira requisição com uma chave a reserva no banco, executa e grava a resposta; repetições
+    com a mesma API key + Idempotency-Key recebem a resposta gravada (header Idempotent-Replayed)
+    sem executar de novo. Duplicatas simultâneas no mesmo processo aguardam a original; entre
+    processos, aguardam a reserva virar resposta por até IDEMPOTENCIA_ESPERA (depois, 409).
+    Mesma chave com outro corpo/rota é 422.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._em_voo: dict[tuple, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not ROTAS_IDEMPOTENTES.match(scope["path"]):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        chave = headers.get(b"idempotency-key", b"").decode("latin-1").strip()
+        if not chave:
+            return await self.app(scope, receive, send)
+        if len(chave) > 255:
+            return await self._erro(send, 400, "Idempotency-Key muito longa (máx. 255)")
+        # chave de API inválida ou acima do limite: segue sem reservar nada, e o require_api_key
+        # responde 401/429 sem gravar no banco (nem passar pela fila de escrita)
+        await chaves_api.garantir()
+        api_chave = chaves_api.buscar(headers.get(b"x-api-key", b"").decode("latin-1"))
+        if api_chave is None or chaves_api.consumir(api_chave):
+            return await self.app(scope, receive, send)
+        scope.setdefault("state", {})["api_key"] = api_chave
+
+        corpo, mais = b"", True
+        while mais:
+            msg = await receive()
+            corpo += msg.get("body", b"")
+            mais = msg.get("more_body", False)
+        escopo = hash_chave(headers.get(b"x-api-key", b"").decode("latin-1"))
+        digest = hashlib.sha256(f"{scope['method']} {scope['path']}\n".encode() + corpo).hexdigest()
+        k = (escopo, chave)
+        loop = asyncio.get_running_loop()
+
+        # duplicata no mesmo processo: espera a original e reaproveita a resposta dela
+        while (voo := self._em_voo.get(k)) is not None and voo.get_loop() is loop:
+            original = await asyncio.shield(voo)
+            if original is not None:
+                if original[0] != digest:
+                    return await self._erro(send, 422, "Idempotency-Key já usada com outra requisição")
+                return await self._responder(send, *original[1:], replay=True)
+
+        voo = self._em_voo[k] = loop.create_future()
+        resultado = None
+        try:
+            limite = time.monotonic() + settings.IDEMPOTENCIA_ESPERA
+            while (estado := await loop.run_in_executor(None, reservar_idempotencia, escopo, chave, digest)) == "ocupado":
+                if time.monotonic() > limite:
+                    return await self._erro(send, 409, "Requisição com esta Idempotency-Key ainda em processamento")
+                await asyncio.sleep(0.2)
+            if estado == "conflito":
+                return await self._erro(send, 422, "Idempotency-Key já usada com outra requisição")
+            if estado is not None:
+                resultado = (digest, *estado)
+                return await self._responder(send, *estado, replay=True)
+
+            try:
+                resposta = await self._executar(scope, receive, send, corpo)
+            except BaseException:
+                await loop.run_in_executor(None, gravar_idempotencia, escopo, chave, None)
+                raise
+            await loop.run_in_executor(None, gravar_idempotencia, escopo, chave, resposta)
+            if resposta is not None:
+                resultado = (digest, *resposta)
+        finally:
+            self._em_voo.pop(k, None)
+            voo.set_result(resultado)
+
+    async def _executar(self, scope, receive, send, corpo: bytes) -> Optional[tuple]:
+        entregue = False
+        status_code, media_type, partes = 500, None, []
+
+        async def _receive():
+            nonlocal entregue
+            if not entregue:
+                entregue = True
+                return {"type": "http.request", "body": corpo, "more_body": False}
+            return await receive()
+
+        async def _send(msg):
+            nonlocal status_code, media_type
+            if msg["type"] == "http.response.start":
+                status_code = msg["status"]
+                media_type = dict(msg.get("headers", [])).get(b"content-type", b"").decode("latin-1") or None
+            elif msg["type"] == "http.response.body":
+                partes.append(msg.get("body", b""))
+            await send(msg)
+
+        await self.app(scope, _receive, _send)
+        if status_code >= 500 or status_code in (401, 403, 409, 429):
+            return None  # erro de servidor, auth ou rate limit não é definitivo: libera nova tentativa
+        return status_code, media_type, b"".join(partes)
+
+    @staticmethod
+    async def _responder(send, status_code: int, media_type: Optional[str], corpo: bytes, replay: bool = False):
+        headers = [(b"content-length", str(len(corpo)).encode())]
+        if media_type:
+            headers.append((b"content-type", media_type.encode("latin-1")))
+        if replay:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": corpo})
+
+    async def _erro(self, send, status_code: int, detalhe: str):
+        await self._responder(send, status_code, "application/json", json.dumps({"detail": detalhe}).encode())
+
+# =========================
+# Despacho para fornecedores (outbox)
+# =========================
+class ErroPermanente(Exception):
+    """Falha de envio que não adianta repetir (destinatário recusado, HTTP 4xx, fornecedor sem e-mail)."""
+
+def backoff_envio(tentativas: int) -> float:
+    # exponencial com jitter: lotes que falharam juntos (ex.: SMTP fora do ar) não voltam juntos
+    espera = min(settings.ENVIO_BACKOFF_MAX, settings.ENVIO_BACKOFF_BASE * 2 ** (tentativas - 1))
+    return espera * (0.5 + random.random() / 2)
+
+def reservar_envios(db: Session, agora: float) -> dict[int, int]:
+    """Reserva um lote de envios vencidos de um mesmo fornecedor; devolve {envio_id: tentativas}.
+
+    O UPDATE condicional é a reserva: outro worker ou processo que leu as mesmas linhas não as
+    atualiza mais (o Postgres reavalia o WHERE depois do lock), então cada envio entra num lote só.
+    A reserva vale 2x ENVIO_TIMEOUT; se o processo cair no meio, o envio volta a vencer.
+    """
+    t = EnvioFornecedor.__table__
+    vencidos = (t.c.status == "pendente") & (t.c.proxima_tentativa <= agora)
+    fornecedor_id = db.scalar(select(t.c.fornecedor_id).where(vencidos).order_by(t.c.proxima_tentativa).limit(1))
+    if fornecedor_id is None:
+        return {}
+    ids = list(db.scalars(select(t.c.id).where(vencidos, t.c.fornecedor_id == fornecedor_id)
+                          .order_by(t.c.id).limit(settings.ENVIO_LOTE)))
+    reservados = db.execute(
+        update(t).where(t.c.id.in_(ids), vencidos)
+        .values(proxima_tentativa=agora + 2 * settings.ENVIO_TIMEOUT, tentativas=t.c.tentativas + 1)
+        .returning(t.c.id, t.c.tentativas)
+    ).all()
+    db.commit()
+    return dict(reservados)
+
+def mensagem_envio(fornecedor: Fornecedor, pedidos: list[Pedido]) -> dict:
+    # conteúdo do lote, igual para e-mail e HTTP; os ids permitem ao fornecedor deduplicar reenvios
+    return {
+        "fornecedor": {"id": fornecedor.id, "codigo": fornecedor.codigo, "razao_social": fornecedor.razao_social,
+                       "email_pedidos": fornecedor.email_pedidos},
+        "pedidos": [{
+            "id": p.id, "unidade": {"codigo": p.unidade.codigo, "nome": p.unidade.nome},
+            "gerente_nome": p.gerente_nome, "contato": p.contato,
+            "desejado_para": p.desejado_para.isoformat() if p.desejado_para else None,
+            "observacoes": p.observacoes, "valor_total": p.valor_total,
+            "itens": [{"produto_codigo": it.produto.codigo, "produto_nome": it.produto.nome,
+                       "unidade_medida": it.produto.unidade_medida, "quantidade": it.quantidade,
+                       "preco": it.preco, "subtotal": it.subtotal} for it in p.itens],
+        } for p in pedidos],
+    }
+
+def texto_envio(msg: dict) -> str:
+    linhas = [f"Olá, {msg['fornecedor']['razao_social']}.", "", "Seguem os pedidos autorizados pela Mais que Café:", ""]
+    for p in msg["pedidos"]:
+        linhas.append(f"Pedido #{p['id']} - {p['unidade']['nome']} (entrega desejada: {p['desejado_para'] or 'a combinar'})")
+        for it in p["itens"]:
+            linhas.append(f"  {it['quantidade']:g} {it['unidade_medida']}  {it['produto_codigo']} {it['produto_nome']}"
+                          f"  x R$ {it['preco']:.2f} = R$ {it['subtotal']:.2f}")
+        linhas.append(f"  Total: R$ {p['valor_total']:.2f}")
+        if p["observacoes"]:
+            linhas.append(f"  Obs.: {p['observacoes']}")
+        if p["contato"]:
+            linhas.append(f"  Contato: {p['gerente_nome']} ({p['contato']})")
+        linhas.append("")
+    return "\n".join(linhas)
+
+def enviar_por_smtp(msg: dict):
+    import smtplib
+    from email.message import EmailMessage
+    destino = msg["fornecedor"]["email_pedidos"]
+    if not destino:
+        raise ErroPermanente("fornecedor sem email_pedidos")
+    ids = [p["id"] for p in msg["pedidos"]]
+    email = EmailMessage()
+    email["Subject"] = "Pedidos Mais que Café: " + ", ".join(f"#{i}" for i in ids)
+    email["From"] = settings.SMTP_REMETENTE
+    email["To"] = destino
+    email["X-Pedidos"] = ",".join(map(str, ids))
+    email.set_content(texto_envio(msg))
+    try:
+        with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.ENVIO_TIMEOUT) as smtp:
+            if settings.SMTP_TLS:
+                smtp.starttls()
+            if settings.SMTP_USUARIO:
+                smtp.login(settings.SMTP_USUARIO, settings.SMTP_SENHA or "")
+            smtp.send_message(email)
+    except smtplib.SMTPRecipientsRefused as e:
+        raise ErroPermanente(f"destinatário recusado: {destino}") from e
+    except smtplib.SMTPResponseException as e:
+        if 500 <= e.smtp_code < 600:  # 4xx é temporário no SMTP
+            raise ErroPermanente(f"SMTP {e.smtp_code}: {e.smtp_error!r}") from e
+        raise
+
+def enviar_por_http(msg: dict):
+    import urllib.error, urllib.request
+    req = urllib.request.Request(settings.ENVIO_HTTP_URL, data=json.dumps(msg).encode(), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=settings.ENVIO_TIMEOUT) as r:
+            r.read()
+    except urllib.error.HTTPError as e:
+        if 400 <= e.code < 500 and e.code not in (408, 429):
+            raise ErroPermanente(f"HTTP {e.code}") from e
+        raise
+
+class DespachoFornecedores:
+    """Pool de workers que drena a outbox envios_fornecedor.
+
+    Cada worker reserva envios vencidos de um mesmo fornecedor, manda uma única mensagem (e-mail
+    ou POST) com todos os pedidos e grava o resultado: enviado; nova tentativa com backoff
+    exponencial; ou "falhou" (dead letter) em erro permanente ou depois de ENVIO_MAX_TENTATIVAS,
+    de onde só sai por POST /envios/{id}/reenviar. A entrega é "pelo menos uma vez": se o processo
+    cair entre enviar e gravar, o lote é reenviado quando a reserva vencer.
+    """
+
+    def __init__(self, transporte: Callable[[dict], None], workers: int):
+        self.transporte = transporte
+        self.workers = workers
+        self._tarefas: list = []
+        self._loop = None
+        self._acordar: Optional[asyncio.Event] = None
+
+    async def iniciar(self):
+        self._loop, self._acordar = asyncio.get_running_loop(), asyncio.Event()
+        self._tarefas = [asyncio.create_task(self._trabalhar()) for _ in range(self.workers)]
+
+    async def parar(self):
+        for t in self._tarefas:
+            t.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        self._tarefas, self._loop = [], None
+
+    def acordar(self):
+        # commit que autorizou pedidos (qualquer thread): não espera o próximo ENVIO_INTERVALO
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._acordar.set)
+            except RuntimeError:  # loop já encerrado
+                pass
+
+    async def _trabalhar(self):
+        while True:
+            self._acordar.clear()
+            try:
+                processados = await asyncio.to_thread(self.processar_lote)
+            except Exception:
+                log.exception("Falha no despacho para fornecedores")
+                processados = 0
+            if not processados:
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), settings.ENVIO_INTERVALO)
+                except asyncio.TimeoutError:
+                    pass
+
+    def processar_lote(self) -> int:
+        with sessao_escrita() as db:
+            reservados = reservar_envios(db, time.time())
+        if not reservados:
+            return 0
+        with SessionLocal() as db:
+            envios = db.scalars(select(EnvioFornecedor).where(EnvioFornecedor.id.in_(list(reservados)))).all()
+            pedidos = {p.id: p for p in db.scalars(
+                select(Pedido).where(Pedido.id.in_({e.pedido_id for e in envios}))
+                .options(selectinload(Pedido.unidade), selectinload(Pedido.itens).selectinload(ItemPedido.produto)))}
+            fornecedor = db.get(Fornecedor, envios[0].fornecedor_id)
+            cancelados = [e.id for e in envios if e.pedido_id not in pedidos]  # pedido excluído depois de autorizado
+            validos = [e.id for e in envios if e.pedido_id in pedidos]
+            msg = mensagem_envio(fornecedor, sorted(pedidos.values(), key=lambda p: p.id)) if fornecedor and pedidos else None
+
+        erro, permanente = None, False
+        if validos:
+            try:
+                if msg is None:
+                    raise ErroPermanente("fornecedor excluído")
+                self.transporte(msg)
+            except ErroPermanente as e:
+                erro, permanente = str(e), True
+            except Exception as e:  # rede, timeout, 5xx: tenta de novo
+                erro = f"{type(e).__name__}: {e}"
+
+        t = EnvioFornecedor.__table__
+        with sessao_escrita() as db:
+            if cancelados:
+                db.execute(update(t).where(t.c.id.in_(cancelados)).values(status="cancelado"))
+            if validos and erro is None:
+                db.execute(update(t).where(t.c.id.in_(validos)).values(status="enviado", enviado_em=func.now(), ultimo_erro=None))
+            for envio_id in validos if erro else ():
+                tentativas = reservados[envio_id]
+                if permanente or tentativas >= settings.ENVIO_MAX_TENTATIVAS:
+                    valores = dict(status="falhou", ultimo_erro=erro)
+                else:
+                    valores = dict(proxima_tentativa=time.time() + backoff_envio(tentativas), ultimo_erro=erro)
+                db.execute(update(t).where(t.c.id == envio_id).values(**valores))
+            db.commit()
+        if erro:
+            log.warning("Envio ao fornecedor %s falhou (%d pedidos): %s", envios[0].fornecedor_id, len(validos), erro)
+        return len(reservados)
+
+despacho = DespachoFornecedores({"smtp": enviar_por_smtp, "http": enviar_por_http}.get(settings.ENVIO_MODO),
+                                settings.ENVIO_WORKERS)
+
+@event.listens_for(Session, "after_commit")
+def _acordar_despacho(db: Session):
+    if db.info.pop("envios", None):
+        despacho.acordar()
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_envios(db: Session):
+    db.info.pop("envios", None)
+
+# =========================
+# Schema & migrations
+# =========================
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+def config_alembic():
+    from alembic.config import Config
+    cfg = Config(os.path.join(RAIZ, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(RAIZ, "migrations"))
+    return cfg
+
+# marca no ambiente que o processo principal (servir) já preparou o banco: os workers não repetem
+BANCO_PREPARADO_ENV = "MQC_BANCO_PREPARADO"
+# arquivo em que cada worker anota o pid ao terminar o startup (lido por acompanhar_workers)
+PRONTOS_ENV = "MQC_WORKERS_PRONTOS"
+
+def garantir_dados_iniciais():
+    """Chaves de settings.API_KEYS e resumo_gastos de um banco anterior a ele. Roda em todo startup,
+    inclusive com MIGRAR_AO_INICIAR=0 (migrations aplicadas no deploy); o schema já tem de existir."""
+    with SessionLocal(bind=engine_escrita) as db:
+        garantir_chaves_settings(db)
+        if db.scalar(select(Pedido.id).limit(1)) and not db.scalar(select(ResumoGasto.id).limit(1)):
+            reconstruir_resumo(db)
+
+def preparar_banco(migrar: bool = True):
+    """Leva o banco à última migration (alembic upgrade head) e garante os dados iniciais.
+
+    Idempotente: banco novo, banco já atualizado ou app.db anterior às migrations (a revisão base
+    completa tabelas, colunas e índices que faltarem). No startup, só o upgrade depende de
+    MIGRAR_AO_INICIAR.
+    """
+    if migrar:
+        from alembic import command
+        cfg = config_alembic()
+        with engine_escrita.begin() as conn:
+            cfg.attributes["connection"] = conn
+            command.upgrade(cfg, "head")
+    garantir_dados_iniciais()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    if not os.environ.get(BANCO_PREPARADO_ENV):
+        await asyncio.to_thread(preparar_banco, settings.MIGRAR_AO_INICIAR)
+    if settings.ENVIO_MODO == "http" and not settings.ENVIO_HTTP_URL:
+        raise RuntimeError("ENVIO_MODO=http exige ENVIO_HTTP_URL")
+    if settings.ENVIO_MODO != "desligado":
+        await despacho.iniciar()
+    INICIALIZACAO["pronto"] = time.perf_counter() - INICIO
+    log_servidor.info("Worker %d pronto em %.2fs (imports %.2fs)", os.getpid(), INICIALIZACAO["pronto"],
+                      INICIALIZACAO["import"])
+    if arquivo := os.environ.get(PRONTOS_ENV):
+        with open(arquivo, "a", encoding="ascii") as f:  # uma linha curta por worker: append atômico
+            f.write(f"{os.getpid()}\n")
+    try:
+        yield
+    finally:
+        await despacho.parar()
 
 # =========================
 # App & Rotas
@@ -268,9 +1851,11 @@ def validar_limites(db: Session, pedido: Pedido) -> bool:
 app = FastAPI(
     title="MaisQueCafe API",
     version="0.2.0",
-    description="Mini-ERP de pedidos para lojas de cafeteria. Use x-api-key em todas as requisições."
+    description="Mini-ERP de pedidos para lojas de cafeteria. Use x-api-key em todas as requisições.",
+    lifespan=lifespan,
 )
 
+app.add_middleware(IdempotenciaMiddleware)  # por dentro do CORS: respostas repetidas também levam os headers
 # CORS: ajuste allow_origins para o domínio do seu painel quando publicar
 app.add_middleware(
     CORSMiddleware,
@@ -278,7 +1863,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After", "Idempotent-Replayed"],
 )
+app.add_middleware(MetricasMiddleware)
 
 @app.get("/", include_in_schema=False)
 def root():
@@ -286,17 +1873,23 @@ def root():
 
 @app.get("/status", tags=["Util"])
 def status_ok():
-    return {"ok": True, "time": datetime.utcnow().isoformat()}
+    return {"ok": True, "time": datetime.utcnow().isoformat(), "pid": os.getpid(), "inicializacao": INICIALIZACAO}
+
+@app.get("/metrics", tags=["Util"], response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(exportar_metricas(), media_type="text/plain; version=0.0.4")
 
 # --------- CADASTROS ---------
 @app.post("/unidades", response_model=UnidadeOut, dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def create_unidade(payload: UnidadeIn, db: Session = Depends(get_db)):
     u = Unidade(**payload.model_dump())
-    db.add(u); db.commit(); db.refresh(u); return u
+    db.add(u); db.commit(); db.refresh(u)
+    catalogo.invalidar("unidades")
+    return u
 
 @app.get("/unidades", response_model=List[UnidadeOut], dependencies=[Depends(require_api_key)], tags=["Cadastros"])
-def list_unidades(db: Session = Depends(get_db)):
-    return db.query(Unidade).all()
+def list_unidades(db: Session = Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    return lista_cacheada("unidades", (), lambda: db.query(Unidade).all(), if_none_match)
 
 @app.delete("/unidades/{unidade_id}", dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def delete_unidade(unidade_id: int, db: Session = Depends(get_db)):
@@ -308,16 +1901,19 @@ def delete_unidade(unidade_id: int, db: Session = Depends(get_db)):
     if has_pedidos:
         raise HTTPException(400, "Unidade possui pedidos vinculados")
     db.delete(u); db.commit()
+    catalogo.invalidar("unidades")
     return {"ok": True}
 
 @app.post("/fornecedores", response_model=FornecedorOut, dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def create_fornecedor(payload: FornecedorIn, db: Session = Depends(get_db)):
     f = Fornecedor(**payload.model_dump())
-    db.add(f); db.commit(); db.refresh(f); return f
+    db.add(f); db.commit(); db.refresh(f)
+    catalogo.invalidar("fornecedores")
+    return f
 
 @app.get("/fornecedores", response_model=List[FornecedorOut], dependencies=[Depends(require_api_key)], tags=["Cadastros"])
-def list_fornecedores(db: Session = Depends(get_db)):
-    return db.query(Fornecedor).all()
+def list_fornecedores(db: Session = Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    return lista_cacheada("fornecedores", (), lambda: db.query(Fornecedor).all(), if_none_match)
 
 @app.delete("/fornecedores/{fornecedor_id}", dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def delete_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
@@ -328,6 +1924,7 @@ def delete_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
     if has_prod:
         raise HTTPException(400, "Fornecedor possui produtos vinculados")
     db.delete(f); db.commit()
+    catalogo.invalidar("fornecedores")
     return {"ok": True}
 
 @app.post("/produtos", response_model=ProdutoOut, dependencies=[Depends(require_api_key)], tags=["Cadastros"])
@@ -335,14 +1932,18 @@ def create_produto(payload: ProdutoIn, db: Session = Depends(get_db)):
     if not db.get(Fornecedor, payload.fornecedor_id):
         raise HTTPException(400, "Fornecedor inválido")
     p = Produto(**payload.model_dump())
-    db.add(p); db.commit(); db.refresh(p); return p
+    db.add(p); db.commit(); db.refresh(p)
+    catalogo.invalidar("produtos")
+    consumo.invalidar()
+    return p
 
 @app.get("/produtos", response_model=List[ProdutoOut], dependencies=[Depends(require_api_key)], tags=["Cadastros"])
-def list_produtos(ativo: Optional[bool] = None, fornecedor_id: Optional[int] = None, db: Session = Depends(get_db)):
+def list_produtos(ativo: Optional[bool] = None, fornecedor_id: Optional[int] = None, db: Session = Depends(get_db),
+                  if_none_match: Optional[str] = Header(None)):
     q = db.query(Produto)
     if ativo is not None: q = q.filter(Produto.ativo == ativo)
     if fornecedor_id is not None: q = q.filter(Produto.fornecedor_id == fornecedor_id)
-    return q.all()
+    return lista_cacheada("produtos", (ativo, fornecedor_id), q.all, if_none_match)
 
 @app.delete("/produtos/{produto_id}", dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def delete_produto(produto_id: int, db: Session = Depends(get_db)):
@@ -356,14 +1957,21 @@ def delete_produto(produto_id: int, db: Session = Depends(get_db)):
     if has_item:
         raise HTTPException(400, "Produto possui itens de pedido")
     db.delete(p); db.commit()
+    catalogo.invalidar("produtos")
+    consumo.invalidar()
     return {"ok": True}
 
 @app.post("/limites", response_model=LimiteOut, dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def create_limite(payload: LimiteIn, db: Session = Depends(get_db)):
     if not db.get(Unidade, payload.unidade_id): raise HTTPException(400, "Unidade inválida")
     if not db.get(Produto, payload.produto_id): raise HTTPException(400, "Produto inválido")
+    existe = db.query(Limite.id).filter(Limite.unidade_id == payload.unidade_id,
+                                        Limite.produto_id == payload.produto_id).first()
+    if existe: raise HTTPException(400, "Limite já cadastrado para esta unidade/produto")
     l = Limite(**payload.model_dump())
-    db.add(l); db.commit(); db.refresh(l); return l
+    db.add(l); db.commit(); db.refresh(l)
+    consumo.invalidar()
+    return l
 
 @app.get("/limites", response_model=List[LimiteOut], dependencies=[Depends(require_api_key)], tags=["Cadastros"])
 def list_limites(db: Session = Depends(get_db)):
@@ -375,13 +1983,89 @@ def delete_limite(limite_id: int, db: Session = Depends(get_db)):
     if not l:
         raise HTTPException(404, "Limite não encontrado")
     db.delete(l); db.commit()
+    consumo.invalidar()
     return {"ok": True}
 
+# --------- API KEYS ---------
+@app.post("/api-keys", response_model=ApiKeyCriada, dependencies=[Depends(require_admin)], tags=["Admin"])
+def criar_api_key(payload: ApiKeyIn, db: Session = Depends(get_db)):
+    chave = secrets.token_urlsafe(32)
+    k = ApiKey(hash=hash_chave(chave), **payload.model_dump())
+    db.add(k); db.commit(); db.refresh(k)
+    chaves_api.invalidar()
+    return ApiKeyCriada(**ApiKeyOut.model_validate(k).model_dump(), chave=chave)
+
+@app.get("/api-keys", response_model=List[ApiKeyOut], dependencies=[Depends(require_admin)], tags=["Admin"])
+def listar_api_keys(db: Session = Depends(get_db)):
+    return db.query(ApiKey).order_by(ApiKey.id).all()
+
+@app.delete("/api-keys/{key_id}", dependencies=[Depends(require_admin)], tags=["Admin"])
+def revogar_api_key(key_id: int, db: Session = Depends(get_db)):
+    k = db.get(ApiKey, key_id)
+    if not k: raise HTTPException(404, "API key não encontrada")
+    k.ativa = False; db.commit()
+    chaves_api.invalidar()
+    return {"ok": True}
+
+# --------- SUGESTÃO DE REPOSIÇÃO ---------
+@app.get("/unidades/{unidade_id}/sugestao", response_model=List[SugestaoOut], dependencies=[Depends(require_api_key)], tags=["Sugestão"])
+def sugestao_unidade(unidade_id: int, db: Session = Depends(get_db)):
+    """Quantidades sugeridas por produto para a unidade (consumo recebido, limites e SLA do fornecedor)."""
+    if not cadastro_por_id(db, Unidade, UnidadeOut, unidade_id): raise HTTPException(404, "Unidade não encontrada")
+    s = sugerir(consumo.obter(db), [unidade_id])
+    colunas = {k: v.tolist() for k, v in s.items()}
+    return [SugestaoOut(**{k: (None if isinstance(v[i], float) and math.isnan(v[i]) else v[i]) for k, v in colunas.items()})
+            for i in range(len(colunas["produto_id"]))]
+
+@app.post("/sugestao/rascunhos", response_model=List[PedidoBulkResultado], dependencies=[Depends(require_api_key)], tags=["Sugestão"])
+def rascunhos_sugeridos(body: SugestaoRascunhosIn, db: Session = Depends(get_db)):
+    """Transforma a sugestão em pedidos rascunho, um por unidade e fornecedor, num único lote.
+
+    Rascunhos contam como pedido em aberto na sugestão seguinte: repetir a chamada só volta a
+    sugerir o que o máximo do Limite cortou.
+    """
+    ids = body.unidade_ids if body.unidade_ids is not None else list(db.scalars(select(Unidade.id).where(Unidade.ativa)))
+    s = sugerir(consumo.obter(db), ids)
+    grupos: dict[tuple, list] = {}
+    for u, f, p, q in zip(s["unidade_id"].tolist(), s["fornecedor_id"].tolist(), s["produto_id"].tolist(),
+                          s["quantidade"].tolist()):
+        grupos.setdefault((u, f), []).append(ItemIn(produto_id=p, quantidade=q))
+    if not grupos:
+        return []
+    pedidos = [PedidoIn(unidade_id=u, fornecedor_id=f, gerente_nome=body.gerente_nome,
+                        observacoes="Sugestão de reposição", itens=itens) for (u, f), itens in grupos.items()]
+    # model_construct: o teto de 5000 pedidos vale para o payload HTTP, não para o lote gerado aqui
+    return criar_pedidos_bulk(PedidosBulkIn.model_construct(pedidos=pedidos, atomico=False), db)
+
+# --------- ENVIOS A FORNECEDORES ---------
+@app.get("/envios", response_model=List[EnvioOut], dependencies=[Depends(require_admin)], tags=["Admin"])
+def listar_envios(
+    status_eq: Optional[Literal["pendente", "enviado", "falhou", "cancelado"]] = Query(None, alias="status"),
+    pedido_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    q = select(EnvioFornecedor).order_by(EnvioFornecedor.id.desc()).limit(limit)
+    if status_eq: q = q.where(EnvioFornecedor.status == status_eq)
+    if pedido_id: q = q.where(EnvioFornecedor.pedido_id == pedido_id)
+    return db.scalars(q).all()
+
+@app.post("/envios/{envio_id}/reenviar", response_model=EnvioOut, dependencies=[Depends(require_admin)], tags=["Admin"])
+def reenviar_envio(envio_id: int, db: Session = Depends(get_db)):
+    # tira da dead letter (ou força de novo um enviado) e volta para a fila agora
+    e = db.get(EnvioFornecedor, envio_id)
+    if not e: raise HTTPException(404, "Envio não encontrado")
+    if e.status == "cancelado": raise HTTPException(400, "Pedido excluído; envio cancelado")
+    e.status, e.tentativas, e.proxima_tentativa = "pendente", 0, time.time()
+    db.info["envios"] = True
+    db.commit(); db.refresh(e)
+    return e
+
 # --------- PEDIDOS ---------
 @app.post("/pedidos", response_model=PedidoOut, dependencies=[Depends(require_api_key)], tags=["Pedidos"])
 def criar_pedido(payload: PedidoIn, db: Session = Depends(get_db)):
-    if not db.get(Unidade, payload.unidade_id): raise HTTPException(400, "Unidade inválida")
-    if not db.get(Fornecedor, payload.fornecedor_id): raise HTTPException(400, "Fornecedor inválido")
+    if not cadastro_por_id(db, Unidade, UnidadeOut, payload.unidade_id): raise HTTPException(400, "Unidade inválida")
+    if not cadastro_por_id(db, Fornecedor, FornecedorOut, payload.fornecedor_id): raise HTTPException(400, "Fornecedor inválido")
 
     pedido = Pedido(
         unidade_id=payload.unidade_id,
@@ -396,7 +2080,7 @@ def criar_pedido(payload: PedidoIn, db: Session = Depends(get_db)):
 
     itens: list[ItemPedido] = []
     for item in payload.itens:
-        prod = db.get(Produto, item.produto_id)
+        prod = cadastro_por_id(db, Produto, ProdutoOut, item.produto_id)
         if not prod or not prod.ativo or prod.fornecedor_id != payload.fornecedor_id:
             raise HTTPException(400, f"Produto {item.produto_id} inválido/fornecedor diferente")
         preco = item.preco if item.preco is not None else prod.preco
@@ -405,39 +2089,350 @@ def criar_pedido(payload: PedidoIn, db: Session = Depends(get_db)):
                                 quantidade=item.quantidade, preco=preco, subtotal=subtotal, motivo=item.motivo))
     pedido.itens = itens
     calcular_total(pedido)
+    registrar_resumo(db, pedido, +1)
+    registrar_evento(db, "criado", pedido)
     db.commit(); db.refresh(pedido)
     return pedido
 
+@app.post("/pedidos/bulk", response_model=List[PedidoBulkResultado], dependencies=[Depends(require_api_key)], tags=["Pedidos"])
+def criar_pedidos_bulk(payload: PedidosBulkIn, db: Session = Depends(get_db)):
+    """Cria vários pedidos (rascunho) numa única transação.
+
+    Unidades, fornecedores e produtos são resolvidos com poucas consultas IN e as linhas são
+    gravadas com executemany. Devolve o resultado por pedido; com `atomico=true`, qualquer erro
+    cancela o lote inteiro (400 com os resultados no detail).
+    """
+    entradas = payload.pedidos
+    unidades = buscar_por_ids(db, [Unidade.id], Unidade.id, [p.unidade_id for p in entradas])
+    fornecedores = buscar_por_ids(db, [Fornecedor.id], Fornecedor.id, [p.fornecedor_id for p in entradas])
+    produtos = buscar_por_ids(db, [Produto.id, Produto.ativo, Produto.fornecedor_id, Produto.preco], Produto.id,
+                              [it.produto_id for p in entradas for it in p.itens])
+
+    resultados: list[PedidoBulkResultado] = []
+    validos: list[tuple[int, PedidoIn, list[dict], float]] = []
+    for idx, ped in enumerate(entradas):
+        erro = None
+        if ped.unidade_id not in unidades: erro = "Unidade inválida"
+        elif ped.fornecedor_id not in fornecedores: erro = "Fornecedor inválido"
+        itens = []
+        for item in ped.itens:
+            if erro: break
+            prod = produtos.get(item.produto_id)
+            if not prod or not prod.ativo or prod.fornecedor_id != ped.fornecedor_id:
+                erro = f"Produto {item.produto_id} inválido/fornecedor diferente"
+                break
+            preco = item.preco if item.preco is not None else prod.preco
+            itens.append(dict(produto_id=prod.id, quantidade=item.quantidade, preco=preco,
+                              subtotal=round(preco * item.quantidade, 2), motivo=item.motivo))
+        if erro:
+            resultados.append(PedidoBulkResultado(indice=idx, ok=False, erro=erro))
+        else:
+            total = round(sum(it["subtotal"] for it in itens), 2)
+            validos.append((idx, ped, itens, total))
+            resultados.append(PedidoBulkResultado(indice=idx, ok=True, valor_total=total))
+
+    if payload.atomico and len(validos) != len(entradas):
+        raise HTTPException(400, [r.model_dump() for r in resultados if not r.ok])
+    if not validos:
+        return resultados
+
+    pedidos_t = Pedido.__table__
+    inseridos = db.execute(
+        insert(pedidos_t).returning(pedidos_t.c.id, pedidos_t.c.criado_em, sort_by_parameter_order=True),
+        [dict(unidade_id=ped.unidade_id, gerente_nome=ped.gerente_nome, contato=ped.contato,
+              fornecedor_id=ped.fornecedor_id, desejado_para=ped.desejado_para,
+              observacoes=ped.observacoes, status=OrderStatus.RASCUNHO, valor_total=total)
+         for _, ped, _, total in validos]
+    ).all()
+    # insert via Core não passa pelo _versionar_pedidos: as versões saem na reserva do commit
+    db.info.setdefault("versionar_ids", []).extend(pedido_id for pedido_id, _ in inseridos)
+    linhas_itens, resumo, eventos = [], db.info.setdefault("resumo", []), db.info.setdefault("eventos", [])
+    for (idx, ped, itens, total), (pedido_id, criado_em) in zip(validos, inseridos):
+        resultados[idx].pedido_id = pedido_id
+        eventos.append(dict(tipo="criado", pedido_id=pedido_id, unidade_id=ped.unidade_id,
+                            status=OrderStatus.RASCUNHO.value, valor_total=total))
+        linhas_itens.extend(dict(it, pedido_id=pedido_id) for it in itens)
+        resumo.extend(linhas_resumo(criado_em, ped.unidade_id, ped.fornecedor_id, OrderStatus.RASCUNHO,
+                                    ((it["produto_id"], it["quantidade"], it["subtotal"]) for it in itens), +1))
+    if linhas_itens:
+        db.execute(insert(ItemPedido.__table__), linhas_itens)
+    db.commit()
+    return resultados
+
+def _filtrar_pedidos(q, unidade_id: Optional[int], fornecedor_id: Optional[int],
+                     status_eq: Optional[OrderStatus], mes: Optional[int], ano: Optional[int]):
+    # serve tanto para Query (ORM) quanto para select() (Core)
+    if unidade_id: q = q.filter(Pedido.unidade_id == unidade_id)
+    if fornecedor_id: q = q.filter(Pedido.fornecedor_id == fornecedor_id)
+    if status_eq: q = q.filter(Pedido.status == status_eq)
+    if mes and ano:
+        ini = datetime(ano, mes, 1)
+        fim = datetime(ano + (mes // 12), ((mes % 12) + 1), 1)
+        q = q.filter(Pedido.criado_em >= ini, Pedido.criado_em < fim)
+    return q
+
+EXPORT_COLUNAS_PEDIDO = ["id", "criado_em", "unidade_id", "fornecedor_id", "gerente_nome", "contato",
+                         "status", "desejado_para", "observacoes", "valor_total"]
+EXPORT_COLUNAS_ITEM = ["item_id", "produto_id", "quantidade", "preco", "subtotal", "motivo"]
+EXPORT_LOTE = 1000
+
+def _exportar_linhas(stmt, formato: str) -> Iterator[str]:
+    # sessão própria: a do Depends(get_db) é fechada antes do corpo ser transmitido
+    with SessionLocal() as db:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_LOTE))
+        n_ped = len(EXPORT_COLUNAS_PEDIDO)
+        if formato == "csv":
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            w.writerow(EXPORT_COLUNAS_PEDIDO + EXPORT_COLUNAS_ITEM)
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+            for lote in result.partitions():
+                for row in lote:
+                    w.writerow([v.value if isinstance(v, OrderStatus) else v for v in row])
+                yield buf.getvalue()
+                buf.seek(0); buf.truncate()
+            return
+
+        # ndjson: uma linha por pedido com seus itens (linhas do join chegam agrupadas por pedido)
+        atual = None
+        for lote in result.partitions():
+            linhas = []
+            for row in lote:
+                if atual is None or atual["id"] != row[0]:
+                    if atual is not None:
+                        linhas.append(json.dumps(atual, default=str, ensure_ascii=False))
+                    atual = dict(zip(EXPORT_COLUNAS_PEDIDO, row[:n_ped]))
+                    atual["criado_em"] = atual["criado_em"].isoformat()
+                    atual["status"] = atual["status"].value
+                    if atual["desejado_para"] is not None:
+                        atual["desejado_para"] = atual["desejado_para"].isoformat()
+                    atual["itens"] = []
+                if row[n_ped] is not None:
+                    atual["itens"].append(dict(zip(["id"] + EXPORT_COLUNAS_ITEM[1:], row[n_ped:])))
+            if linhas:
+                yield "\n".join(linhas) + "\n"
+        if atual is not None:
+            yield json.dumps(atual, default=str, ensure_ascii=False) + "\n"
+
+@app.get("/pedidos/export", dependencies=[Depends(require_api_key)], tags=["Pedidos"])
+def exportar_pedidos(
+    unidade_id: Optional[int] = None,
+    fornecedor_id: Optional[int] = None,
+    status_eq: Optional[OrderStatus] = None,
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    ano: Optional[int] = Query(None, ge=1, le=9998),  # o fim do intervalo é ano + 1
+    formato: Literal["ndjson", "csv"] = "ndjson"
+):
+    """Exporta pedidos e itens em streaming (NDJSON: um pedido por linha; CSV: uma linha por item).
+
+    Aceita os mesmos filtros de `GET /pedidos` e lê o resultado em lotes via cursor do servidor,
+    então o uso de memória não cresce com o tamanho do histórico.
+    """
+    stmt = select(
+        Pedido.id, Pedido.criado_em, Pedido.unidade_id, Pedido.fornecedor_id, Pedido.gerente_nome,
+        Pedido.contato, Pedido.status, Pedido.desejado_para, Pedido.observacoes, Pedido.valor_total,
+        ItemPedido.id, ItemPedido.produto_id, ItemPedido.quantidade, ItemPedido.preco,
+        ItemPedido.subtotal, ItemPedido.motivo
+    ).outerjoin(ItemPedido, ItemPedido.pedido_id == Pedido.id)
+    stmt = _filtrar_pedidos(stmt, unidade_id, fornecedor_id, status_eq, mes, ano)
+    stmt = stmt.order_by(Pedido.criado_em.desc(), Pedido.id.desc(), ItemPedido.id)
+
+    if formato == "csv":
+        media_type, nome = "text/csv; charset=utf-8", "pedidos.csv"
+    else:
+        media_type, nome = "application/x-ndjson", "pedidos.ndjson"
+    return StreamingResponse(_exportar_linhas(stmt, formato), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+@app.get("/pedidos/changes", response_model=MudancasOut, dependencies=[Depends(require_api_key)], tags=["Pedidos"])
+def mudancas_pedidos(
+    db: Session = Depends(get_db),
+    since: int = Query(0, ge=0),
+    unidade_id: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=1000)
+):
+    """Sincronização incremental: pedidos criados/alterados e excluídos depois de `since`.
+
+    Toda mudança num pedido (inclusive itens, aprovações e recebimentos) dá a ele uma `versao`
+    nova e crescente; exclusões aparecem em `removidos`. Comece com `since=0`, aplique cada item
+    pela sua versão e repasse `cursor` na próxima chamada; com `mais=true` há outra página.
+    """
+    q = (db.query(Pedido)
+         .options(selectinload(Pedido.itens), selectinload(Pedido.aprovacoes), selectinload(Pedido.recebimentos))
+         .filter(Pedido.versao > since))
+    r = select(PedidoRemovido).where(PedidoRemovido.versao > since)
+    if unidade_id is not None:
+        q = q.filter(Pedido.unidade_id == unidade_id)
+        r = r.where(PedidoRemovido.unidade_id == unidade_id)
+    pedidos = q.order_by(Pedido.versao).limit(limit + 1).all()
+    removidos = db.scalars(r.order_by(PedidoRemovido.versao).limit(limit + 1)).all()
+
+    mudancas = sorted(pedidos + removidos, key=lambda m: m.versao)
+    mais = len(mudancas) > limit
+    mudancas = mudancas[:limit]
+    return MudancasOut(
+        pedidos=[PedidoSyncOut.model_validate(m) for m in mudancas if isinstance(m, Pedido)],
+        removidos=[RemovidoOut.model_validate(m) for m in mudancas if isinstance(m, PedidoRemovido)],
+        cursor=mudancas[-1].versao if mudancas else since,
+        mais=mais,
+    )
+
+EVENTOS_PING = 15.0  # segundos; comentário SSE que mantém proxies e o navegador conectados
+
+def _sse(id_evento: str, evento: dict) -> str:
+    return f"id: {id_evento}\nevent: pedido\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+@app.get("/pedidos/eventos", dependencies=[Depends(require_api_key)], tags=["Pedidos"])
+async def eventos_pedidos_sse(
+    request: Request,
+    unidade_id: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Stream (Server-Sent Events) das mudanças de pedidos: criado, status e removido.
+
+    Cada evento traz `tipo`, `pedido_id`, `unidade_id`, `status` e `valor_total`; filtre por
+    `unidade_id` para receber só a sua loja. Ao reconectar com `Last-Event-ID` o servidor reenvia
+    o que foi perdido; se não for possível (reinício, buffer estourado), envia `event: reset` e o
+    cliente deve recarregar a lista. Os eventos são do processo que atende a conexão.
+    """
+    async def _stream():
+        # assina só quando o stream começa: se o cliente cair antes (ou a resposta nem chegar a
+        # ser montada), nenhuma fila fica registrada acumulando eventos
+        assinatura, perdidos, reset = eventos_pedidos.assinar(last_event_id)
+        fila = assinatura[1]
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                yield "event: reset\ndata: {}\n\n"
+            for id_evento, evento in perdidos:
+                if unidade_id is None or evento["unidade_id"] == unidade_id:
+                    yield _sse(id_evento, evento)
+            while True:
+                try:
+                    item = await asyncio.wait_for(fila.get(), EVENTOS_PING)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    return
+                id_evento, evento = item
+                if unidade_id is None or evento["unidade_id"] == unidade_id:
+                    yield _sse(id_evento, evento)
+        finally:
+            eventos_pedidos.cancelar(assinatura)
+
+    return StreamingResponse(_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/pedidos/{pedido_id}", response_model=PedidoOut, dependencies=[Depends(require_api_key)], tags=["Pedidos"])
 def obter_pedido(pedido_id: int, db: Session = Depends(get_db)):
     p = db.get(Pedido, pedido_id)
     if not p: raise HTTPException(404, "Pedido não encontrado")
     return p
 
+def _encode_cursor(p: Pedido) -> str:
+    raw = f"{p.criado_em.isoformat()}|{p.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        criado_em, pid = raw.split("|")
+        return datetime.fromisoformat(criado_em), int(pid)
+    except ValueError:
+        raise HTTPException(400, "Cursor inválido")
+
+# Caminho rápido da listagem: tuplas do Core direto para JSON, sem montar objetos ORM nem
+# validar PedidoOut linha a linha. Os campos (nomes, ordem e conversões) saem dos próprios
+# schemas, então o resultado é byte a byte o do response_model (ver benchmarks/serializacao_pedidos.py).
+def _conversor_json(anotacao) -> Optional[Callable]:
+    tipos = [t for t in get_args(anotacao) if t is not type(None)] or [anotacao]
+    tipo = tipos[0]
+    if tipo is float:
+        f = float  # Numeric/Decimal e inteiros saem como float, como no Pydantic
+    elif tipo is datetime:
+        f = datetime.isoformat  # colunas sem timezone: mesmo formato do modo json do Pydantic
+    elif tipo is date:
+        f = date.isoformat
+    elif isinstance(tipo, type) and issubclass(tipo, Enum):
+        f = lambda v: v.value
+    else:
+        return None
+    if type(None) in get_args(anotacao):
+        return lambda v: None if v is None else f(v)
+    return f
+
+_CAMPOS_PEDIDO = [(c, _conversor_json(f.annotation)) for c, f in PedidoOut.model_fields.items() if c != "itens"]
+_CAMPOS_ITEM = [(c, _conversor_json(f.annotation)) for c, f in ItemOut.model_fields.items()]
+_COLUNAS_PEDIDO = [getattr(Pedido, c) for c, _ in _CAMPOS_PEDIDO]
+_COLUNAS_ITEM = [ItemPedido.pedido_id] + [getattr(ItemPedido, c) for c, _ in _CAMPOS_ITEM]
+
+def _dumps(dados, floats: list) -> bytes:
+    # orjson só difere do json.dumps (usado pelo JSONResponse) na notação de floats fora de
+    # [1e-4, 1e16): nesses casos raros fica o json da stdlib, para manter os mesmos bytes
+    if orjson is not None and all(1e-4 <= abs(v) < 1e16 or v == 0 for v in floats):
+        return orjson.dumps(dados)
+    return json.dumps(dados, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def pedidos_json(db: Session, linhas) -> bytes:
+    """Serializa linhas de `select(*_COLUNAS_PEDIDO)` com seus itens como List[PedidoOut]."""
+    floats = []
+    itens: dict[int, list] = {}
+    ids = [r.id for r in linhas]
+    for i in range(0, len(ids), IN_LOTE):
+        stmt = select(*_COLUNAS_ITEM).where(ItemPedido.pedido_id.in_(ids[i:i + IN_LOTE])).order_by(ItemPedido.id)
+        for it in db.execute(stmt):
+            d = {c: (f(v) if f else v) for (c, f), v in zip(_CAMPOS_ITEM, it[1:])}
+            floats += (d["quantidade"], d["preco"], d["subtotal"])
+            itens.setdefault(it[0], []).append(d)
+    saida = []
+    for r in linhas:
+        d = {c: (f(v) if f else v) for (c, f), v in zip(_CAMPOS_PEDIDO, r)}
+        d["itens"] = itens.get(r.id, [])
+        floats.append(d["valor_total"])
+        saida.append(d)
+    return _dumps(saida, floats)
+
+PAGINA_PEDIDOS = 100  # GET /pedidos sem limit: nunca devolve a tabela inteira
+
 @app.get("/pedidos", response_model=List[PedidoOut], dependencies=[Depends(require_api_key)], tags=["Pedidos"])
 def listar_pedidos(
     db: Session = Depends(get_db),
     unidade_id: Optional[int] = None,
     fornecedor_id: Optional[int] = None,
     status_eq: Optional[OrderStatus] = None,
-    mes: Optional[int] = None,
-    ano: Optional[int] = None
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    ano: Optional[int] = Query(None, ge=1, le=9998),  # o fim do intervalo é ano + 1
+    limit: int = Query(PAGINA_PEDIDOS, ge=1, le=1000),
+    cursor: Optional[str] = None
 ):
-    q = db.query(Pedido)
-    if unidade_id: q = q.filter(Pedido.unidade_id == unidade_id)
-    if fornecedor_id: q = q.filter(Pedido.fornecedor_id == fornecedor_id)
-    if status_eq: q = q.filter(Pedido.status == status_eq)
-    if mes and ano:
-        from datetime import datetime as dt
-        ini = dt(ano, mes, 1)
-        fim = dt(ano + (mes // 12), ((mes % 12) + 1), 1)
-        q = q.filter(Pedido.criado_em >= ini, Pedido.criado_em < fim)
-    return q.order_by(Pedido.criado_em.desc()).all()
+    """Lista pedidos do mais recente ao mais antigo, `limit` por página (padrão 100).
+
+    Pagina por keyset em (criado_em, id): se houver mais páginas, o header `X-Next-Cursor` traz o
+    valor a repassar em `cursor` na próxima chamada.
+    """
+    stmt = _filtrar_pedidos(select(*_COLUNAS_PEDIDO), unidade_id, fornecedor_id, status_eq, mes, ano)
+    if cursor:
+        c_criado, c_id = _decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Pedido.criado_em, Pedido.id) < tuple_(literal(c_criado, DataHora), literal(c_id)))
+    stmt = stmt.order_by(Pedido.criado_em.desc(), Pedido.id.desc()).limit(limit + 1)
+
+    linhas = db.execute(stmt).all()
+    headers = {}
+    if len(linhas) > limit:
+        linhas = linhas[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(linhas[-1])
+    return Response(content=pedidos_json(db, linhas), media_type="application/json", headers=headers)
 
 @app.delete("/pedidos/{pedido_id}", dependencies=[Depends(require_api_key)], tags=["Pedidos"])
 def deletar_pedido(pedido_id: int, db: Session = Depends(get_db)):
     p = db.get(Pedido, pedido_id)
     if not p: raise HTTPException(404, "Pedido não encontrado")
+    registrar_resumo(db, p, -1)
+    registrar_evento(db, "removido", p)
     db.delete(p); db.commit()
     return {"ok": True}
 
@@ -451,10 +2446,35 @@ def enviar_pedido(pedido_id: int, db: Session = Depends(get_db)):
 
     calcular_total(p)
     precisa = validar_limites(db, p)
-    p.status = OrderStatus.PENDENTE_APROVACAO if precisa else OrderStatus.AUTORIZADO
+    mudar_status(db, p, OrderStatus.PENDENTE_APROVACAO if precisa else OrderStatus.AUTORIZADO)
     db.commit(); db.refresh(p)
     return p
 
+@app.post("/pedidos/enviar", response_model=List[EnvioResultado], dependencies=[Depends(require_api_key)], tags=["Fluxo"])
+def enviar_pedidos_lote(body: EnviarLoteIn, db: Session = Depends(get_db)):
+    ids = list(dict.fromkeys(body.pedido_ids))
+    pedidos = {}
+    for i in range(0, len(ids), IN_LOTE):
+        for p in db.query(Pedido).options(selectinload(Pedido.itens)).filter(Pedido.id.in_(ids[i:i + IN_LOTE])):
+            pedidos[p.id] = p
+
+    enviaveis = [p for p in pedidos.values() if p.status == OrderStatus.RASCUNHO]
+    fora = pedidos_fora_do_limite(db, [p.id for p in enviaveis])
+    resultados = []
+    for pid in ids:
+        p = pedidos.get(pid)
+        if not p:
+            resultados.append(EnvioResultado(pedido_id=pid, ok=False, erro="Pedido não encontrado"))
+        elif p.status != OrderStatus.RASCUNHO:
+            resultados.append(EnvioResultado(pedido_id=pid, ok=False, status=p.status,
+                                             erro=f"Status atual ({p.status}) não permite enviar"))
+        else:
+            calcular_total(p)
+            mudar_status(db, p, OrderStatus.PENDENTE_APROVACAO if pid in fora else OrderStatus.AUTORIZADO)
+            resultados.append(EnvioResultado(pedido_id=pid, ok=True, status=p.status))
+    db.commit()
+    return resultados
+
 @app.post("/pedidos/{pedido_id}/aprovar", response_model=PedidoOut, dependencies=[Depends(require_api_key)], tags=["Fluxo"])
 def aprovar_pedido(pedido_id: int, body: AprovarIn, db: Session = Depends(get_db)):
     p = db.get(Pedido, pedido_id)
@@ -464,9 +2484,9 @@ def aprovar_pedido(pedido_id: int, body: AprovarIn, db: Session = Depends(get_db
 
     db.add(Aprovacao(pedido_id=p.id, decisor=body.decisor, aprovado=body.aprovado, motivo=body.motivo))
     if body.aprovado:
-        p.status = OrderStatus.AUTORIZADO
+        mudar_status(db, p, OrderStatus.AUTORIZADO)
     else:
-        p.status = OrderStatus.REPROVADO
+        mudar_status(db, p, OrderStatus.REPROVADO)
     db.commit(); db.refresh(p)
     return p
 
@@ -478,16 +2498,169 @@ def registrar_recebimento(pedido_id: int, body: RecebimentoIn, db: Session = Dep
         raise HTTPException(400, f"Status atual ({p.status}) não permite recebimento")
     db.add(Recebimento(pedido_id=p.id, data_recebimento=body.data_recebimento,
                        quantidade_recebida=body.quantidade_recebida, divergencia=body.divergencia))
-    p.status = OrderStatus.RECEBIDO
+    mudar_status(db, p, OrderStatus.RECEBIDO)
     db.commit(); db.refresh(p)
     return p
 
+# --------- RELATÓRIOS ---------
+GASTO_STATUS_PADRAO = [OrderStatus.APROVADO, OrderStatus.AUTORIZADO, OrderStatus.RECEBIDO]
 
-if __name__ == "__main__":
-    import uvicorn, webbrowser, threading, time
-    def _open_browser():
-        time.sleep(1.5)
-        webbrowser.open("http://127.0.0.1:8000/painel")
+@app.get("/relatorios/gastos", response_model=List[GastoOut], dependencies=[Depends(require_api_key)], tags=["Relatórios"])
+def relatorio_gastos(
+    db: Session = Depends(get_db),
+    ano: Optional[int] = None,
+    mes: Optional[int] = None,
+    unidade_id: Optional[int] = None,
+    fornecedor_id: Optional[int] = None,
+    produto_id: Optional[int] = None,
+    status_in: List[OrderStatus] = Query(GASTO_STATUS_PADRAO),
+    agrupar_por: List[Literal["mes", "unidade", "fornecedor", "produto"]] = Query(["mes", "unidade", "fornecedor"])
+):
+    """Gasto e volume agregados a partir de `resumo_gastos` (lê O(grupos), não pedidos/itens).
+
+    Por padrão considera pedidos aprovados/autorizados/recebidos; use `status_in` para mudar.
+    """
+    r = ResumoGasto
+    colunas = {"mes": [r.ano, r.mes], "unidade": [r.unidade_id], "fornecedor": [r.fornecedor_id], "produto": [r.produto_id]}
+    grupo = [c for chave in ("mes", "unidade", "fornecedor", "produto") if chave in agrupar_por for c in colunas[chave]]
+    q = select(*grupo, func.sum(r.quantidade).label("quantidade"), func.sum(r.valor).label("valor"),
+               func.sum(r.itens).label("itens")).where(r.status.in_(status_in))
+    if ano: q = q.where(r.ano == ano)
+    if mes: q = q.where(r.mes == mes)
+    if unidade_id: q = q.where(r.unidade_id == unidade_id)
+    if fornecedor_id: q = q.where(r.fornecedor_id == fornecedor_id)
+    if produto_id: q = q.where(r.produto_id == produto_id)
+    if grupo:
+        q = q.group_by(*grupo).order_by(*grupo)
+    return [GastoOut(**dict(row._mapping, valor=round(row.valor or 0.0, 2), quantidade=row.quantidade or 0.0,
+                            itens=row.itens or 0))
+            for row in db.execute(q)]
+
+# --------- MODO ASYNC (settings.ASYNC_DB) ---------
+# Mesma regra de negócio das rotas acima, executada via AsyncSession.run_sync: o I/O do banco
+# é aguardado no event loop em vez de ocupar uma thread do threadpool do Starlette.
+# A serialização acontece dentro do run_sync porque lazy loads fora dele não são permitidos.
+rotas_async = APIRouter(dependencies=[Depends(require_api_key)])
+
+@rotas_async.post("/pedidos", response_model=PedidoOut, tags=["Pedidos"])
+async def criar_pedido_async(payload: PedidoIn, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: PedidoOut.model_validate(criar_pedido(payload, s)))
+
+@rotas_async.post("/pedidos/bulk", response_model=List[PedidoBulkResultado], tags=["Pedidos"])
+async def criar_pedidos_bulk_async(payload: PedidosBulkIn, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: criar_pedidos_bulk(payload, s))
+
+@rotas_async.get("/pedidos/changes", response_model=MudancasOut, tags=["Pedidos"])
+async def mudancas_pedidos_async(
+    db: "AsyncSession" = Depends(get_async_db),
+    since: int = Query(0, ge=0),
+    unidade_id: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=1000)
+):
+    return await db.run_sync(lambda s: mudancas_pedidos(s, since, unidade_id, limit))
+
+@rotas_async.get("/pedidos/{pedido_id}", response_model=PedidoOut, tags=["Pedidos"])
+async def obter_pedido_async(pedido_id: int, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: PedidoOut.model_validate(obter_pedido(pedido_id, s)))
 
-    threading.Thread(target=_open_browser, daemon=True).start()
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+@rotas_async.get("/pedidos", response_model=List[PedidoOut], tags=["Pedidos"])
+async def listar_pedidos_async(
+    db: "AsyncSession" = Depends(get_async_db),
+    unidade_id: Optional[int] = None,
+    fornecedor_id: Optional[int] = None,
+    status_eq: Optional[OrderStatus] = None,
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    ano: Optional[int] = Query(None, ge=1, le=9998),  # o fim do intervalo é ano + 1
+    limit: int = Query(PAGINA_PEDIDOS, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    return await db.run_sync(lambda s: listar_pedidos(s, unidade_id, fornecedor_id, status_eq, mes, ano, limit, cursor))
+
+@rotas_async.delete("/pedidos/{pedido_id}", tags=["Pedidos"])
+async def deletar_pedido_async(pedido_id: int, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: deletar_pedido(pedido_id, s))
+
+@rotas_async.post("/pedidos/{pedido_id}/enviar", response_model=PedidoOut, tags=["Fluxo"])
+async def enviar_pedido_async(pedido_id: int, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: PedidoOut.model_validate(enviar_pedido(pedido_id, s)))
+
+@rotas_async.post("/pedidos/enviar", response_model=List[EnvioResultado], tags=["Fluxo"])
+async def enviar_pedidos_lote_async(body: EnviarLoteIn, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: enviar_pedidos_lote(body, s))
+
+@rotas_async.post("/pedidos/{pedido_id}/aprovar", response_model=PedidoOut, tags=["Fluxo"])
+async def aprovar_pedido_async(pedido_id: int, body: AprovarIn, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: PedidoOut.model_validate(aprovar_pedido(pedido_id, body, s)))
+
+@rotas_async.post("/pedidos/{pedido_id}/recebimentos", response_model=PedidoOut, tags=["Fluxo"])
+async def registrar_recebimento_async(pedido_id: int, body: RecebimentoIn, db: "AsyncSession" = Depends(get_async_db)):
+    return await db.run_sync(lambda s: PedidoOut.model_validate(registrar_recebimento(pedido_id, body, s)))
+
+def usar_rotas_async(app: FastAPI, router: APIRouter):
+    # troca as rotas sync de mesmo path/método pelas async
+    novas = {(r.path, m) for r in router.routes for m in r.methods}
+    app.router.routes = [r for r in app.router.routes
+                         if not (isinstance(r, APIRoute) and any((r.path, m) in novas for m in r.methods))]
+    app.include_router(router)
+
+if settings.ASYNC_DB:
+    usar_rotas_async(app, rotas_async)
+
+
+INICIALIZACAO["import"] = time.perf_counter() - INICIO
+
+def acompanhar_workers(arquivo: str, url: str, workers: int, abrir_navegador: bool, prazo: float = 60.0):
+    # cada worker anota o próprio pid em `arquivo` no fim do lifespan (PRONTOS_ENV); o processo principal
+    # só lê esse arquivo local: uma requisição pela porta compartilhada pode cair em qualquer worker
+    import webbrowser
+    prontos: list[str] = []
+    while len(prontos) < workers and time.perf_counter() - INICIO < prazo:
+        time.sleep(0.1)
+        with open(arquivo, encoding="ascii") as f:
+            novos = f.read().split()[len(prontos):]
+        for pid in novos:
+            prontos.append(pid)
+            log_servidor.info("Worker %s pronto (%d/%d) em %.2fs desde o início", pid, len(prontos), workers,
+                              time.perf_counter() - INICIO)
+            if len(prontos) == 1 and abrir_navegador:
+                webbrowser.open(url + "/painel")
+    if len(prontos) < workers:
+        log_servidor.warning("Só %d de %d workers ficaram prontos em %.0fs", len(prontos), workers, prazo)
+
+def servir():
+    """Sobe o servidor: esquema e dados iniciais uma vez aqui, depois WORKERS processos na mesma porta."""
+    import atexit
+    import logging.config
+    import tempfile
+    import uvicorn
+    logging.config.dictConfig(uvicorn.config.LOGGING_CONFIG)
+    workers = settings.WORKERS or os.cpu_count() or 1
+    preparar_banco(settings.MIGRAR_AO_INICIAR)
+    engine.dispose()  # os workers abrem as próprias conexões
+    # já preparado: nem os workers nem o lifespan deste processo repetem
+    os.environ[BANCO_PREPARADO_ENV] = "1"
+    log_servidor.info("Processo principal pronto em %.2fs (imports %.2fs); subindo %d worker(s) em %s:%d",
+                      time.perf_counter() - INICIO, INICIALIZACAO["import"], workers, settings.HOST, settings.PORT)
+    url = f"http://{'127.0.0.1' if settings.HOST in ('0.0.0.0', '::') else settings.HOST}:{settings.PORT}"
+    fd, prontos = tempfile.mkstemp(prefix="mqc-workers-", suffix=".txt")
+    os.close(fd)
+    atexit.register(os.remove, prontos)
+    os.environ[PRONTOS_ENV] = prontos  # herdado pelos workers
+    threading.Thread(target=acompanhar_workers, args=(prontos, url, workers, not settings.HEADLESS),
+                     daemon=True).start()
+    if workers == 1:
+        uvicorn.run(app, host=settings.HOST, port=settings.PORT)
+        return
+    log_servidor.warning("Com %d workers, eventos SSE, cache do catálogo, baldes de rate limit, cache das "
+                         "chaves de API e estatísticas da sugestão ficam por processo (ver README)", workers)
+    # uvicorn sobe os workers com multiprocessing "spawn". O spawn lê __main__.__file__ e reexecuta este
+    # script inteiro como __mp_main__ em cada filho (rotas, engine, catálogo...) antes de o worker importar
+    # "main:app" -- ou seja, main.py seria carregado duas vezes por worker, dobrando o tempo de subida.
+    # Sem __file__ o spawn não tem o que reexecutar e cada filho importa main uma vez só. Nada depois
+    # daqui usa __main__.__file__ (RAIZ já foi calculado a partir do __file__ do módulo).
+    vars(sys.modules["__main__"]).pop("__file__", None)
+    uvicorn.run("main:app", host=settings.HOST, port=settings.PORT, workers=workers)
+
+
+if __name__ == "__main__":
+    servir()
@@ -5,8 +5,9 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[],
-    hiddenimports=[],
+    datas=[('alembic.ini', '.'), ('migrations', 'migrations')],
+    # 'main': com WORKERS>1 cada worker importa main:app (o script em si roda como __main__)
+    hiddenimports=['main', 'alembic.op', 'alembic.context', 'logging.config', 'sqlalchemy.dialects.postgresql'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,51 @@
+"""Ambiente do Alembic.
+
+Chamado pelo app (preparar_banco passa a conexão em config.attributes) ou pela linha de comando
+(`alembic upgrade head`), quando a URL e os modelos vêm do próprio main.py.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+config = context.config
+conexao = config.attributes.get("connection")
+
+
+def metadata():
+    # só o autogenerate compara com os modelos; o upgrade pelo app não reimporta o main
+    if conexao is not None:
+        return None
+    from main import Base
+    return Base.metadata
+
+
+def opcoes(dialeto: str) -> dict:
+    # SQLite não altera colunas in-place: o modo batch recria a tabela quando preciso
+    return {"target_metadata": metadata(), "render_as_batch": dialeto == "sqlite", "compare_type": True}
+
+
+def offline():
+    from main import settings
+    url = settings.DATABASE_URL
+    context.configure(url=url, literal_binds=True, dialect_opts={"paramstyle": "named"},
+                      **opcoes(url.split(":", 1)[0].split("+", 1)[0]))
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def online(conn):
+    context.configure(connection=conn, **opcoes(conn.dialect.name))
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    offline()
+elif conexao is not None:
+    online(conexao)
+else:
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name, disable_existing_loggers=False)
+    from main import engine_escrita
+    with engine_escrita.begin() as conn:
+        online(conn)
@@ -0,0 +1,51 @@
+"""dinheiro em numeric
+
+Preços, subtotais, totais e o resumo de gastos passam de FLOAT para NUMERIC: no Postgres as somas
+e relatórios ficam exatos. O app continua lendo como float (Numeric(asdecimal=False)). No SQLite a
+tabela é recriada pelo modo batch; os valores são os mesmos.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 13:05:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (tabela, coluna, casas decimais)
+COLUNAS = [
+    ("produtos", "preco", 4),
+    ("pedidos", "valor_total", 2),
+    ("itens_pedido", "preco", 4),
+    ("itens_pedido", "subtotal", 2),
+    ("resumo_gastos", "valor", 2),
+]
+
+
+def alterar(para_numeric: bool):
+    insp = sa.inspect(op.get_bind())
+    tabelas: dict[str, list] = {}
+    for tabela, coluna, escala in COLUNAS:
+        atual = next(c["type"] for c in insp.get_columns(tabela) if c["name"] == coluna)
+        if (getattr(atual, "scale", None) == escala) != para_numeric:
+            tabelas.setdefault(tabela, []).append((coluna, escala, atual))
+    for tabela, colunas in tabelas.items():
+        with op.batch_alter_table(tabela) as batch:
+            for coluna, escala, atual in colunas:
+                batch.alter_column(coluna, existing_type=atual, existing_nullable=False,
+                                   type_=sa.Numeric(14, escala, asdecimal=False) if para_numeric else sa.Float())
+
+
+def upgrade() -> None:
+    alterar(True)
+
+
+def downgrade() -> None:
+    alterar(False)
@@ -0,0 +1,40 @@
+"""envios ao fornecedor (outbox)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:10:27.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DataHora = sa.DateTime().with_variant(sqlite.DATETIME(), "sqlite")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "envios_fornecedor",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pedido_id", sa.Integer(), nullable=False),
+        sa.Column("fornecedor_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("tentativas", sa.Integer(), nullable=False),
+        sa.Column("proxima_tentativa", sa.Float(), nullable=False),
+        sa.Column("ultimo_erro", sa.String(), nullable=True),
+        sa.Column("criado_em", DataHora, nullable=False),
+        sa.Column("enviado_em", DataHora, nullable=True),
+    )
+    op.create_index("ix_envios_fornecedor_fila", "envios_fornecedor", ["status", "proxima_tentativa"])
+    op.create_index("ix_envios_fornecedor_pedido", "envios_fornecedor", ["pedido_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("envios_fornecedor")
@@ -56,10 +56,13 @@ async function enviar() {
             method: "POST",
             headers: {
                 "Content-Type": "application/json",
-                "x-api-key": key
+                "x-api-key": key,
+                // mesma chave até o servidor responder: reenviar após queda de rede não duplica o pedido
+                "Idempotency-Key": chavePedido
             },
             body: JSON.stringify(body)
         });
+        chavePedido = novaChave();  // houve resposta: a próxima tentativa é outra requisição
         const data = await r.json();
         if (!r.ok) throw data;
 
@@ -69,19 +72,23 @@ async function enviar() {
         const btn = document.createElement("button");
         btn.textContent = `Enviar pedido #${data.id} para aprovação/autorizar`;
         btn.style.marginTop = "12px";
+        let chaveEnvio = novaChave();  // nova por tentativa; só reaproveitada se a rede cair antes da resposta
         btn.onclick = async () => {
             btn.textContent = "Enviando...";
             btn.disabled = true;
             try {
                 const r2 = await fetch(`${base}/pedidos/${data.id}/enviar`, {
                     method: "POST",
-                    headers: { "x-api-key": key }
+                    headers: { "x-api-key": key, "Idempotency-Key": chaveEnvio }
                 });
+                chaveEnvio = novaChave();
                 const d2 = await r2.json();
                 if(!r2.ok) throw d2;
                 out.textContent = "Pedido enviado com sucesso!\n\n" + JSON.stringify(d2, null, 2);
             } catch (e2) {
                 out.textContent += "\n\nErro ao enviar o pedido:\n" + JSON.stringify(e2, null, 2);
+                btn.textContent = `Tentar enviar o pedido #${data.id} de novo`;
+                btn.disabled = false;
             }
         };
         out.appendChild(btn);
@@ -91,5 +98,8 @@ async function enviar() {
     }
 }
 
+function novaChave() { return crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2) }
+let chavePedido = novaChave();
+
 // Adiciona uma linha de item inicial quando a página carrega
 document.addEventListener('DOMContentLoaded', addItem);
\ No newline at end of file
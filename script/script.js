@@ -1,16 +1,26 @@
 // Helpers -------------------------------------------------
 function base() { return document.getElementById("base").value.trim() }
 function key() { return document.getElementById("key").value.trim() }
+function novaChave() { return crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2) }
 async function api(path, opts = {}) {
-  const r = await fetch(base() + path, {
-    headers: Object.assign({ "x-api-key": key(), "Content-Type": "application/json" }, opts.headers || {}),
-    method: opts.method || "GET",
-    body: opts.body ? JSON.stringify(opts.body) : undefined
-  });
+  // com idempotente, a requisição leva Idempotency-Key e é repetida se a rede cair: o servidor
+  // devolve a resposta da primeira em vez de criar/mudar o pedido de novo
+  const headers = Object.assign({ "x-api-key": key(), "Content-Type": "application/json" }, opts.headers || {});
+  if (opts.idempotente) headers["Idempotency-Key"] = novaChave();
+  let r;
+  for (let tentativa = 1; ; tentativa++) {
+    try {
+      r = await fetch(base() + path, { headers, method: opts.method || "GET", body: opts.body ? JSON.stringify(opts.body) : undefined });
+      break;
+    } catch (e) {
+      if (!opts.idempotente || tentativa >= 3) throw e;
+      await new Promise(ok => setTimeout(ok, 1000 * tentativa));
+    }
+  }
   let data = null;
   try { data = await r.json() } catch (e) { }
   if (!r.ok) throw (data || { detail: r.statusText, status: r.status });
-  return data;
+  return opts.resposta ? { data, headers: r.headers } : data;
 }
 function el(tag, attrs = {}, html = "") { const e = document.createElement(tag); Object.entries(attrs).forEach(([k, v]) => e.setAttribute(k, v)); e.innerHTML = html; return e; }
 function money(v) { return (v || 0).toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' }) }
@@ -156,9 +166,9 @@ async function criarPedido() {
     itens
   };
   try {
-    const p = await api("/pedidos", { method: "POST", body });
+    const p = await api("/pedidos", { method: "POST", body, idempotente: true });
     document.getElementById("pedido-out").textContent = "Pedido criado: #" + p.id + " | total " + money(p.valor_total) + " | status " + p.status + "\nClique em Enviar na tabela abaixo.";
-    listarPedidos();
+    recarregarPedidos();
   } catch (e) { alert("Erro: " + (e.detail || JSON.stringify(e))); }
 }
 function setMesAno() {
@@ -166,46 +176,105 @@ function setMesAno() {
   document.getElementById("mes").value = d.getMonth() + 1;
   document.getElementById("ano").value = d.getFullYear();
 }
-async function listarPedidos() {
+// GET /pedidos é paginado: "Carregar mais" segue o X-Next-Cursor da página anterior
+let cursorPedidos = null;
+async function listarPedidos(mais = false) {
   const mes = parseInt(v("mes") || "");
   const ano = parseInt(v("ano") || "");
-  const qs = (!isNaN(mes) && !isNaN(ano)) ? `?mes=${mes}&ano=${ano}` : "";
-  const ps = await api("/pedidos" + qs);
+  const qs = new URLSearchParams({ limit: 100 });
+  if (!isNaN(mes) && !isNaN(ano)) { qs.set("mes", mes); qs.set("ano", ano); }
+  if (mais && cursorPedidos) qs.set("cursor", cursorPedidos);
+  const { data: ps, headers } = await api("/pedidos?" + qs, { resposta: true });
+  cursorPedidos = headers.get("X-Next-Cursor");
+  document.getElementById("pedidos-mais").style.display = cursorPedidos ? "" : "none";
   const us = await api("/unidades"); const mapU = Object.fromEntries(us.map(u => [u.id, u]));
   const fs = await api("/fornecedores"); const mapF = Object.fromEntries(fs.map(f => [f.id, f]));
   const tb = document.getElementById("pedidos-body");
-  tb.innerHTML = ps.map(p => {
-    const badge = p.status === "autorizado" ? "ok" : (p.status === "pendente_aprovacao" ? "warn" : "pill");
-    return `<tr>
+  const linhas = ps.map(p => {
+    return `<tr data-id="${p.id}">
       <td>${p.id}</td>
       <td>${new Date(p.criado_em).toLocaleString('pt-BR')}</td>
       <td>${mapU[p.unidade_id]?.codigo || p.unidade_id}</td>
       <td>${mapF[p.fornecedor_id]?.codigo || p.fornecedor_id}</td>
-      <td><span class="pill ${badge}">${p.status}</span></td>
-      <td>${money(p.valor_total)}</td>
+      <td class="status">${badgeStatus(p.status)}</td>
+      <td class="total">${money(p.valor_total)}</td>
       <td class="actions">
         <button onclick="enviar(${p.id})">Enviar</button>
         <button onclick="aprovar(${p.id}, true)">Aprovar</button>
         <button onclick="aprovar(${p.id}, false)">Reprovar</button>
         <button onclick="receber(${p.id})">Receber</button>
-        <button onclick="del('/pedidos/${p.id}', listarPedidos)">Excluir</button>
+        <button onclick="del('/pedidos/${p.id}', recarregarPedidos)">Excluir</button>
       </td>
     </tr>`
   }).join("");
+  if (mais) tb.insertAdjacentHTML("beforeend", linhas); else tb.innerHTML = linhas;
+}
+function badgeStatus(st) {
+  const badge = st === "autorizado" ? "ok" : (st === "pendente_aprovacao" ? "warn" : "pill");
+  return `<span class="pill ${badge}">${st}</span>`;
+}
+// atualiza só a linha do pedido (resposta da ação ou evento), sem baixar a lista de novo
+function atualizarLinha(p) {
+  const tr = document.querySelector(`#pedidos-body tr[data-id="${p.id ?? p.pedido_id}"]`);
+  if (!tr) return false;
+  tr.querySelector(".status").innerHTML = badgeStatus(p.status);
+  tr.querySelector(".total").textContent = money(p.valor_total);
+  return true;
 }
-async function enviar(id) { try { await api(`/pedidos/${id}/enviar`, { method: "POST" }); listarPedidos(); } catch (e) { alert("Erro: " + (e.detail || JSON.stringify(e))); } }
+async function enviar(id) { try { atualizarLinha(await api(`/pedidos/${id}/enviar`, { method: "POST", idempotente: true })); } catch (e) { alert("Erro: " + (e.detail || JSON.stringify(e))); } }
 async function aprovar(id, ok) {
-  try { await api(`/pedidos/${id}/aprovar`, { method: "POST", body: { decisor: "Matriz", aprovado: ok } }); listarPedidos(); }
+  try { atualizarLinha(await api(`/pedidos/${id}/aprovar`, { method: "POST", body: { decisor: "Matriz", aprovado: ok }, idempotente: true })); }
   catch (e) { alert("Erro: " + (e.detail || JSON.stringify(e))); }
 }
 async function receber(id) {
   const hoje = new Date().toISOString().slice(0, 10);
   const qtd = prompt("Quantidade recebida:", "1");
   if (qtd === null) return;
-  try { await api(`/pedidos/${id}/recebimentos`, { method: "POST", body: { data_recebimento: hoje, quantidade_recebida: parseFloat(qtd) } }); listarPedidos(); }
+  try { atualizarLinha(await api(`/pedidos/${id}/recebimentos`, { method: "POST", body: { data_recebimento: hoje, quantidade_recebida: parseFloat(qtd) }, idempotente: true })); }
   catch (e) { alert("Erro: " + (e.detail || JSON.stringify(e))); }
 }
 
+// Eventos (SSE) --------------------------------------------
+// Lê /pedidos/eventos via fetch (EventSource não envia o header x-api-key) e aplica cada
+// mudança na tabela; criações e "reset" recarregam a lista uma vez só (debounce).
+let ultimoEvento = null, recarga = null;
+function recarregarPedidos() { clearTimeout(recarga); recarga = setTimeout(listarPedidos, 300); }
+function aplicarEvento(tipo, ev) {
+  if (!document.getElementById("pedidos-body")) return;
+  if (tipo === "reset" || ev.tipo === "criado") return recarregarPedidos();
+  if (ev.tipo === "removido") return document.querySelector(`#pedidos-body tr[data-id="${ev.pedido_id}"]`)?.remove();
+  atualizarLinha(ev);
+}
+async function ouvirEventos() {
+  for (;;) {
+    try {
+      const headers = { "x-api-key": key() };
+      if (ultimoEvento) headers["Last-Event-ID"] = ultimoEvento;
+      const r = await fetch(base() + "/pedidos/eventos", { headers });
+      if (!r.ok) throw r.status;
+      const leitor = r.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buf = "";
+      for (;;) {
+        const { value, done } = await leitor.read();
+        if (done) break;
+        buf += value;
+        let fim;
+        while ((fim = buf.indexOf("\n\n")) >= 0) {
+          const bloco = buf.slice(0, fim); buf = buf.slice(fim + 2);
+          let tipo = "message", data = "";
+          for (const ln of bloco.split("\n")) {
+            if (ln.startsWith("id: ")) ultimoEvento = ln.slice(4);
+            else if (ln.startsWith("event: ")) tipo = ln.slice(7);
+            else if (ln.startsWith("data: ")) data += ln.slice(6);
+          }
+          if (tipo === "pedido" || tipo === "reset") aplicarEvento(tipo, JSON.parse(data || "{}"));
+        }
+      }
+    } catch (e) { console.warn("eventos:", e); }
+    await new Promise(ok => setTimeout(ok, 3000));  // reconecta retomando do último id
+  }
+}
+
 // Utils ---------------------------------------------------
 function v(id) { return document.getElementById(id).value }
 function limpar(ids) { ids.forEach(id => document.getElementById(id).value = "") }
@@ -215,4 +284,5 @@ async function del(path, after) { if (!confirm("Tem certeza que deseja excluir?"
 // Adiciona um listener para garantir que o DOM está carregado antes de executar o script inicial.
 document.addEventListener('DOMContentLoaded', (event) => {
     ping(); // tenta conectar ao abrir
+    ouvirEventos();
 });
\ No newline at end of file
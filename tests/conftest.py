@@ -0,0 +1,36 @@
+"""Banco SQLite temporário para a sessão de testes: o main lê o DATABASE_URL ao ser importado."""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+_TMP = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP.name}/testes.db"
+os.environ["ENVIO_MODO"] = "desligado"
+
+import main  # noqa: E402 (depende do DATABASE_URL acima)
+from fastapi.testclient import TestClient  # noqa: E402
+
+H = {"x-api-key": "dev-123"}
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    main.preparar_banco()
+    return TestClient(main.app)  # sem lifespan: despacho e eventos não sobem
+
+
+@pytest.fixture
+def novo_pedido(cliente):
+    """Corpo de POST /pedidos numa unidade/fornecedor/produto recém-cadastrados."""
+    codigo = uuid.uuid4().hex[:8]
+    u = cliente.post("/unidades", headers=H, json={"codigo": f"U{codigo}", "nome": "Loja"}).json()
+    f = cliente.post("/fornecedores", headers=H, json={"codigo": f"F{codigo}", "razao_social": "Torrefação"}).json()
+    p = cliente.post("/produtos", headers=H, json={"codigo": f"P{codigo}", "nome": "Café", "fornecedor_id": f["id"],
+                                                   "preco": 10}).json()
+
+    def corpo(quantidade: float = 2) -> dict:
+        return {"unidade_id": u["id"], "fornecedor_id": f["id"], "gerente_nome": "teste",
+                "itens": [{"produto_id": p["id"], "quantidade": quantidade}]}
+    return corpo
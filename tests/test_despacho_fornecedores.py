@@ -0,0 +1,171 @@
+"""Despacho de pedidos autorizados (outbox envios_fornecedor) contra receptores SMTP/HTTP de mentira."""
+import json
+import socketserver
+import threading
+import uuid
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+import pytest
+
+from conftest import H
+
+
+@pytest.fixture
+def envio(monkeypatch):
+    monkeypatch.setattr(main.settings, "ENVIO_BACKOFF_BASE", 0.0)  # nova tentativa vence na hora
+    monkeypatch.setattr(main.settings, "ENVIO_MAX_TENTATIVAS", 3)
+    return monkeypatch
+
+
+def fornecedor(c, prefixo: str) -> dict:
+    codigo = f"{prefixo}-{uuid.uuid4().hex[:8]}"
+    f = c.post("/fornecedores", headers=H, json={"codigo": codigo, "razao_social": codigo,
+                                                 "email_pedidos": f"{codigo}@fornecedor.test"}).json()
+    f["produto"] = c.post("/produtos", headers=H, json={"codigo": f"P{codigo}", "nome": "Café", "fornecedor_id": f["id"],
+                                                        "preco": 10}).json()["id"]
+    return f
+
+
+def autorizar(c, f: dict) -> int:
+    u = c.post("/unidades", headers=H, json={"codigo": f"U{uuid.uuid4().hex[:8]}", "nome": "Loja"}).json()
+    p = c.post("/pedidos", headers=H, json={"unidade_id": u["id"], "fornecedor_id": f["id"], "gerente_nome": "teste",
+                                            "itens": [{"produto_id": f["produto"], "quantidade": 2}]}).json()
+    r = c.post(f"/pedidos/{p['id']}/enviar", headers=H)
+    assert r.json()["status"] == "autorizado", r.text
+    return p["id"]
+
+
+def envios(c, pedido_id: int) -> list[dict]:
+    return c.get("/envios", headers=H, params={"pedido_id": pedido_id}).json()
+
+
+def drenar(transporte):
+    despacho = main.DespachoFornecedores(transporte, 1)
+    for _ in range(20):
+        if not despacho.processar_lote():
+            return
+    raise AssertionError("a fila não esvaziou")
+
+
+@pytest.fixture
+def receptor_http():
+    recebidos, respostas = [], {}  # respostas: prefixo do código do fornecedor -> lista de status a devolver
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            msg = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            fila = respostas.get(msg["fornecedor"]["codigo"].split("-")[0], [])
+            codigo = fila.pop(0) if fila else 200
+            if codigo == 200:
+                recebidos.append(msg)
+            self.send_response(codigo)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *_):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}/pedidos", recebidos, respostas
+    srv.shutdown()
+
+
+@pytest.fixture
+def receptor_smtp():
+    recebidos = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        # o mínimo de SMTP que o smtplib usa: EHLO, MAIL, RCPT, DATA, QUIT
+        def handle(self):
+            self.wfile.write(b"220 teste\r\n")
+            dados = None
+            for linha in self.rfile:
+                if dados is not None:
+                    if linha.rstrip(b"\r\n") == b".":
+                        recebidos.append(message_from_bytes(b"".join(dados)))
+                        dados = None
+                        self.wfile.write(b"250 OK\r\n")
+                    else:
+                        dados.append(linha[1:] if linha.startswith(b"..") else linha)
+                    continue
+                cmd = linha.decode().strip().upper()
+                if cmd.startswith("RCPT") and "RECUSA" in cmd:
+                    self.wfile.write(b"550 caixa inexistente\r\n")
+                elif cmd == "DATA":
+                    dados = []
+                    self.wfile.write(b"354 termine com .\r\n")
+                elif cmd == "QUIT":
+                    self.wfile.write(b"221 tchau\r\n")
+                    return
+                else:
+                    self.wfile.write(b"250 OK\r\n")
+
+    srv = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv.server_address[1], recebidos
+    srv.shutdown()
+
+
+def test_desligado_nao_enfileira(cliente):
+    assert main.settings.ENVIO_MODO == "desligado"
+    pid = autorizar(cliente, fornecedor(cliente, "F"))
+    assert envios(cliente, pid) == []
+
+
+def test_http_entrega_repete_falha_temporaria_e_recusa(cliente, envio, receptor_http):
+    url, recebidos, respostas = receptor_http
+    envio.setattr(main.settings, "ENVIO_MODO", "http")
+    envio.setattr(main.settings, "ENVIO_HTTP_URL", url)
+    respostas["instavel"] = [503, 503]
+    respostas["recusa"] = [422]
+    ok, instavel, recusa = fornecedor(cliente, "ok"), fornecedor(cliente, "instavel"), fornecedor(cliente, "recusa")
+    pedidos = {"ok": [autorizar(cliente, ok), autorizar(cliente, ok)], "instavel": [autorizar(cliente, instavel)],
+               "recusa": [autorizar(cliente, recusa)]}
+
+    drenar(main.enviar_por_http)
+
+    entregues = [[p["id"] for p in m["pedidos"]] for m in recebidos]
+    assert sorted(entregues) == sorted([pedidos["ok"], pedidos["instavel"]])  # um lote por fornecedor
+    [e] = envios(cliente, pedidos["instavel"][0])
+    assert (e["status"], e["tentativas"]) == ("enviado", 3)
+    [e] = envios(cliente, pedidos["recusa"][0])
+    assert (e["status"], e["tentativas"]) == ("falhou", 1)
+    assert "422" in e["ultimo_erro"]
+
+
+def test_http_esgota_tentativas(cliente, envio, receptor_http):
+    url, recebidos, respostas = receptor_http
+    envio.setattr(main.settings, "ENVIO_MODO", "http")
+    envio.setattr(main.settings, "ENVIO_HTTP_URL", url)
+    respostas["fora"] = [503] * 10
+    pid = autorizar(cliente, fornecedor(cliente, "fora"))
+
+    drenar(main.enviar_por_http)
+
+    assert recebidos == []
+    [e] = envios(cliente, pid)
+    assert (e["status"], e["tentativas"]) == ("falhou", 3)
+    r = cliente.post(f"/envios/{e['id']}/reenviar", headers=H)
+    assert r.status_code == 200 and r.json()["status"] == "pendente"
+
+
+def test_smtp_manda_um_email_por_fornecedor(cliente, envio, receptor_smtp):
+    porta, recebidos = receptor_smtp
+    envio.setattr(main.settings, "ENVIO_MODO", "smtp")
+    envio.setattr(main.settings, "SMTP_HOST", "127.0.0.1")
+    envio.setattr(main.settings, "SMTP_PORT", porta)
+    f, recusa = fornecedor(cliente, "smtp"), fornecedor(cliente, "recusa")
+    pids = [autorizar(cliente, f), autorizar(cliente, f)]
+    recusado = autorizar(cliente, recusa)
+
+    drenar(main.enviar_por_smtp)
+
+    [email] = [m for m in recebidos if m["To"] == f["email_pedidos"]]
+    assert email["X-Pedidos"] == ",".join(map(str, pids))
+    assert all(envios(cliente, p)[0]["status"] == "enviado" for p in pids)
+    [e] = envios(cliente, recusado)
+    assert e["status"] == "falhou" and "recusado" in e["ultimo_erro"]
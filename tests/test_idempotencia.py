@@ -0,0 +1,87 @@
+"""Idempotency-Key em POST /pedidos e nas transições (IdempotenciaMiddleware)."""
+import asyncio
+import uuid
+
+import httpx
+import main
+from sqlalchemy import func, select
+
+from conftest import H
+
+
+def chave() -> dict:
+    return dict(H, **{"Idempotency-Key": uuid.uuid4().hex})
+
+
+def pedidos_da_unidade(unidade_id: int) -> int:
+    with main.SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(main.Pedido).where(main.Pedido.unidade_id == unidade_id))
+
+
+def test_repeticao_devolve_a_resposta_gravada(cliente, novo_pedido):
+    h, corpo = chave(), novo_pedido()
+    r1 = cliente.post("/pedidos", headers=h, json=corpo)
+    r2 = cliente.post("/pedidos", headers=h, json=corpo)
+    assert r1.status_code == r2.status_code == 200
+    assert "idempotent-replayed" not in r1.headers and r2.headers["idempotent-replayed"] == "true"
+    assert r2.json() == r1.json()
+    assert pedidos_da_unidade(corpo["unidade_id"]) == 1
+
+
+def test_transicao_repetida_nao_executa_de_novo(cliente, novo_pedido):
+    pid = cliente.post("/pedidos", headers=H, json=novo_pedido()).json()["id"]
+    h = chave()
+    r1 = cliente.post(f"/pedidos/{pid}/enviar", headers=h)
+    r2 = cliente.post(f"/pedidos/{pid}/enviar", headers=h)
+    assert r1.status_code == 200, r1.text
+    assert r2.status_code == 200 and r2.json() == r1.json()  # sem a chave seria 400 (já enviado)
+    assert cliente.post(f"/pedidos/{pid}/enviar", headers=chave()).status_code == 400
+
+
+def test_mesma_chave_com_outro_corpo_e_422(cliente, novo_pedido):
+    h = chave()
+    assert cliente.post("/pedidos", headers=h, json=novo_pedido(2)).status_code == 200
+    r = cliente.post("/pedidos", headers=h, json=novo_pedido(3))
+    assert r.status_code == 422
+    assert "outra requisição" in r.json()["detail"]
+
+
+def test_mesma_chave_em_outra_rota_e_422(cliente, novo_pedido):
+    h = chave()
+    pid = cliente.post("/pedidos", headers=h, json=novo_pedido()).json()["id"]
+    assert cliente.post(f"/pedidos/{pid}/enviar", headers=h).status_code == 422
+
+
+def test_duplicatas_simultaneas_criam_um_pedido(cliente, novo_pedido):
+    h, corpo = chave(), novo_pedido()
+
+    async def disparar():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as c:
+            return await asyncio.gather(*(c.post("/pedidos", headers=h, json=corpo) for _ in range(8)))
+
+    respostas = asyncio.run(disparar())
+    assert {r.status_code for r in respostas} == {200}
+    assert len({r.json()["id"] for r in respostas}) == 1
+    assert sum(r.headers.get("idempotent-replayed") == "true" for r in respostas) == 7
+    assert pedidos_da_unidade(corpo["unidade_id"]) == 1
+
+
+def test_reserva_de_outro_processo_segura_a_duplicata(cliente, novo_pedido, monkeypatch):
+    # outro worker reservou a chave e ainda não respondeu: a duplicata espera e desiste com 409
+    monkeypatch.setattr(main.settings, "IDEMPOTENCIA_ESPERA", 0.3)
+    h, corpo = chave(), novo_pedido()
+    req = cliente.build_request("POST", "/pedidos", headers=h, json=corpo)
+    digest = main.hashlib.sha256(b"POST /pedidos\n" + req.read()).hexdigest()
+    assert main.reservar_idempotencia(main.hash_chave(H["x-api-key"]), h["Idempotency-Key"], digest) is None
+
+    r = cliente.send(req)
+    assert r.status_code == 409
+    assert pedidos_da_unidade(corpo["unidade_id"]) == 0
+
+
+def test_chave_de_api_invalida_nao_reserva(cliente, novo_pedido):
+    h, corpo = chave(), novo_pedido()
+    assert cliente.post("/pedidos", headers=dict(h, **{"x-api-key": "errada"}), json=corpo).status_code == 401
+    r = cliente.post("/pedidos", headers=h, json=corpo)
+    assert r.status_code == 200 and "idempotent-replayed" not in r.headers
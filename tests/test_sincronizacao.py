@@ -0,0 +1,80 @@
+"""Sincronização incremental: versões dos pedidos e GET /pedidos/changes (cursor e tombstones)."""
+from conftest import H
+
+
+def mudancas(c, unidade_id: int, since: int = 0, limit: int = 500) -> dict:
+    r = c.get("/pedidos/changes", headers=H, params={"since": since, "unidade_id": unidade_id, "limit": limit})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def em_ordem(resposta: dict) -> list[tuple]:
+    # o que o cliente aplica: pedidos e remoções intercalados pela versão
+    itens = [(p["versao"], "pedido", p["id"], p["status"]) for p in resposta["pedidos"]]
+    itens += [(r["versao"], "removido", r["pedido_id"], None) for r in resposta["removidos"]]
+    return sorted(itens)
+
+
+def test_delta_traz_alteracoes_e_remocoes_na_ordem_das_versoes(cliente, novo_pedido):
+    corpo = novo_pedido()
+    unidade = corpo["unidade_id"]
+    a, b, c = (cliente.post("/pedidos", headers=H, json=corpo).json()["id"] for _ in range(3))
+    carga = mudancas(cliente, unidade)
+    assert [i[2] for i in em_ordem(carga)] == [a, b, c]
+    assert carga["removidos"] == [] and carga["mais"] is False
+
+    assert cliente.post(f"/pedidos/{a}/enviar", headers=H).json()["status"] == "autorizado"
+    assert cliente.delete(f"/pedidos/{b}", headers=H).status_code == 200
+    cliente.post(f"/pedidos/{c}/enviar", headers=H)
+    cliente.post(f"/pedidos/{c}/recebimentos", headers=H,
+                 json={"data_recebimento": "2026-01-01", "quantidade_recebida": 2})
+
+    delta = mudancas(cliente, unidade, since=carga["cursor"])
+    assert [(tipo, pid, st) for _, tipo, pid, st in em_ordem(delta)] == [
+        ("pedido", a, "autorizado"), ("removido", b, None), ("pedido", c, "recebido")]
+    versoes = [i[0] for i in em_ordem(delta)]
+    assert versoes[0] > carga["cursor"] and len(set(versoes)) == 3
+    assert delta["cursor"] == versoes[-1]
+    assert mudancas(cliente, unidade, since=delta["cursor"]) == {"pedidos": [], "removidos": [],
+                                                                 "cursor": delta["cursor"], "mais": False}
+
+
+def test_paginacao_pelo_cursor_nao_perde_nem_repete(cliente, novo_pedido):
+    corpo = novo_pedido()
+    unidade = corpo["unidade_id"]
+    ids = [cliente.post("/pedidos", headers=H, json=corpo).json()["id"] for _ in range(4)]
+    cliente.delete(f"/pedidos/{ids[1]}", headers=H)
+    cliente.post(f"/pedidos/{ids[0]}/enviar", headers=H)
+    completo = em_ordem(mudancas(cliente, unidade))
+
+    paginado, cursor, mais = [], 0, True
+    while mais:
+        pagina = mudancas(cliente, unidade, since=cursor, limit=1)
+        paginado += em_ordem(pagina)
+        cursor, mais = pagina["cursor"], pagina["mais"]
+    assert paginado == completo
+    assert [(tipo, pid) for _, tipo, pid, _ in completo] == [
+        ("pedido", ids[2]), ("pedido", ids[3]), ("removido", ids[1]), ("pedido", ids[0])]
+
+
+def test_uma_versao_por_transacao(cliente, novo_pedido):
+    # pedido com itens é um commit só: reserva uma versão, não uma por flush
+    corpo = novo_pedido()
+    primeiro = cliente.post("/pedidos", headers=H, json=corpo).json()["id"]
+    segundo = cliente.post("/pedidos", headers=H, json=corpo).json()["id"]
+    versoes = {p["id"]: p["versao"] for p in mudancas(cliente, corpo["unidade_id"])["pedidos"]}
+    assert versoes[segundo] == versoes[primeiro] + 1
+
+
+def test_pedidos_em_lote_entram_no_delta(cliente, novo_pedido):
+    corpo = novo_pedido()
+    unidade = corpo["unidade_id"]
+    antes = cliente.post("/pedidos", headers=H, json=corpo).json()["id"]
+    cursor = mudancas(cliente, unidade)["cursor"]
+    lote = cliente.post("/pedidos/bulk", headers=H, json={"pedidos": [corpo, corpo, corpo]}).json()
+    depois = cliente.post("/pedidos", headers=H, json=corpo).json()["id"]
+
+    delta = em_ordem(mudancas(cliente, unidade, since=cursor))
+    assert [pid for _, _, pid, _ in delta] == [r["pedido_id"] for r in lote] + [depois]
+    assert antes not in [pid for _, _, pid, _ in delta]
+    assert [v for v, *_ in delta] == list(range(cursor + 1, cursor + 5))